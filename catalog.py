@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from ingredient_filter import RULES, VERDICT_COLUMNS, compute_verdicts
+from name_index import NameIndex
+
+# Setup
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXTRACTED_DIR = os.path.join(BASE_DIR, "Data", "Woolies Extracted")
+# Converted catalogs live here (generated from the scraped files, not committed)
+CATALOG_DIR = os.path.join(BASE_DIR, "Data", "Woolies Catalog")
+
+# General categories and the extracted files that make them up (pantry was scraped into 2 files)
+CATEGORY_FILES = {
+    "bakery": ["Woolies bakery info.xlsx"],
+    "dairy-eggs-fridge": ["Woolies dairy-eggs-fridge info.xlsx"],
+    "deli-chilled-meals": ["Woolies deli-chilled-meals info.xlsx"],
+    "drinks": ["Woolies drinks info.xlsx"],
+    "freezer": ["Woolies freezer info.xlsx"],
+    "fruit-veg": ["Woolies fruit-veg info.xlsx"],
+    "health-wellness health-foods": ["Woolies health-wellness health-foods info.xlsx"],
+    "lunch-box": ["Woolies lunch-box info.xlsx"],
+    "pantry": ["Woolies pantry 1 info.xlsx", "Woolies pantry 2 info.xlsx"],
+    "poultry-meat-seafood": ["Woolies poultry-meat-seafood info.xlsx"],
+}
+# Columns of the ID scraper outputs (the CSVs have no header)
+ID_COLUMNS = {
+    "woolies": ["ID", "Name", "Price", "Cup Price", "Link"],
+    "coles": ["ID", "Name", "Price", "Link"],
+}
+NUMERIC_COLUMNS = ["Price", "Cup Price"]
+# Seconds between 2 checks for a new scrape in Data/Woolies Extracted (0: only reload when asked)
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", 60))
+
+
+def catalog_path(name: str) -> str:
+    return os.path.join(CATALOG_DIR, f"Woolies {name}.arrow")
+
+
+# Output of extract_items.py for a category: its products in the catalog format, extracted from the raw details
+def extracted_path(category: str) -> str:
+    return os.path.join(EXTRACTED_DIR, f"Woolies {category}.arrow")
+
+
+# The scraped files a catalog is made from: the extracted Arrow file if there is one, the XLSX files otherwise
+def category_sources(category: str) -> List[str]:
+    if os.path.exists(extracted_path(category)):
+        return [extracted_path(category)]
+    return [os.path.join(EXTRACTED_DIR, file_name) for file_name in CATEGORY_FILES[category]]
+
+
+# The extracted files mix bools, numbers and "None" strings in the same column -> make every column one type
+def _clean_frame(df: pd.DataFrame) -> pd.DataFrame:
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def _is_stale(target: str, sources: List[str]) -> bool:
+    if not os.path.exists(target):
+        return True
+    return any(os.path.getmtime(source) > os.path.getmtime(target) for source in sources)
+
+
+# Write uncompressed so the file can be memory-mapped as is
+def _write_frame(df: pd.DataFrame, path: str, metadata: Optional[Dict[str, str]] = None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+    # One tmp file per process: several workers can convert the same category after a new scrape
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+# Add the bad list verdicts to a catalog (the bad list used is saved with the file)
+def _add_verdicts(df: pd.DataFrame, path: str) -> pd.DataFrame:
+    df = df.drop(columns=VERDICT_COLUMNS, errors="ignore")
+    df = pd.concat([df, compute_verdicts(df["Ingredients"])], axis=1)
+    _write_frame(df, path, {"bad_list": json.dumps(RULES)})
+    return df
+
+
+# Convert the scraped files of a category into one Arrow file. Only runs when the scraped files are newer
+def convert_category(category: str, force: bool = False) -> str:
+    sources = category_sources(category)
+    path = catalog_path(category)
+    if force or _is_stale(path, sources):
+        print("Converting catalog: ", category)
+        if sources == [extracted_path(category)]:
+            # Already in the catalog format: copied as is, the verdicts are checked when it's loaded
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(sources[0], tmp_path)
+            os.replace(tmp_path, path)
+            return path
+        df = pd.concat([pd.read_excel(source) for source in sources], ignore_index=True)
+        _add_verdicts(_clean_frame(df), path)
+    return path
+
+
+# Convert a CSV from the ID scrapers (Data/Woolies ID, Data/Coles ID) into an Arrow file
+def convert_csv(csv_path: str, store: str = "woolies", force: bool = False) -> str:
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    path = os.path.join(CATALOG_DIR, store, f"{name}.arrow")
+    if force or _is_stale(path, [csv_path]):
+        df = pd.read_csv(csv_path, header=None, names=ID_COLUMNS[store])
+        _write_frame(_clean_frame(df), path)
+    return path
+
+
+def read_table(path: str) -> pa.Table:
+    # Memory-mapped: numeric columns are read straight from the page cache instead of parsed
+    return feather.read_table(path, memory_map=True)
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    return read_table(path).to_pandas()
+
+
+# Load the catalog of a category, converting it first if needed
+# The numeric columns (prices, verdicts) stay views of the memory-mapped file: no copy, and the page cache
+# is shared by every worker process
+def load_catalog(category: str) -> pd.DataFrame:
+    path = convert_category(category)
+    table = read_table(path)
+    df = table.to_pandas(split_blocks=True)
+    # The bad list changed since the conversion -> recompute the verdicts only
+    if (table.schema.metadata or {}).get(b"bad_list") != json.dumps(RULES).encode():
+        print("Recomputing bad list verdicts: ", category)
+        df = _add_verdicts(df, path)
+    return df
+
+
+# Version of the scraped files: changes when one of them is added, removed or rewritten
+def source_version(categories: Optional[List[str]] = None) -> str:
+    signature = []
+    for category in categories or CATEGORY_FILES:
+        for path in category_sources(category):
+            stat = os.stat(path) if os.path.exists(path) else None
+            signature.append([os.path.basename(path), stat.st_mtime_ns if stat else None, stat.st_size if stat else None])
+    return hashlib.sha256(json.dumps(signature).encode()).hexdigest()[:12]
+
+
+# The catalogs of every category and their name indexes, from one version of the scraped files
+# A request takes the current snapshot once and uses it to the end: a reload builds a new snapshot
+# and swaps it in, the requests still running keep the old one
+class CatalogSnapshot:
+    def __init__(self, version: str, categories: Optional[List[str]] = None):
+        self.version = version
+        self.categories: Dict[str, pd.DataFrame] = {}
+        self.name_indexes: Dict[str, NameIndex] = {}
+        self.built_at = None
+        self.build_seconds = None
+        # Categories not built yet are loaded on first use (ex: scripts that only need one category)
+        self.lock = threading.RLock()
+        if categories is not None:
+            self.build(categories)
+
+    def build(self, categories: List[str]):
+        start = time.perf_counter()
+        for category in categories:
+            self.get_name_index(category)
+        self.built_at = time.time()
+        self.build_seconds = time.perf_counter() - start
+
+    def get_catalog(self, category: str) -> pd.DataFrame:
+        if category not in self.categories:
+            with self.lock:
+                if category not in self.categories:
+                    self.categories[category] = load_catalog(category)
+        return self.categories[category]
+
+    def get_name_index(self, category: str) -> NameIndex:
+        if category not in self.name_indexes:
+            with self.lock:
+                if category not in self.name_indexes:
+                    self.name_indexes[category] = NameIndex(self.get_catalog(category)["Product Name"])
+        return self.name_indexes[category]
+
+    def info(self) -> Dict:
+        return {
+            "version": self.version,
+            "built_at": self.built_at,
+            "build_seconds": self.build_seconds,
+            "categories": {category: len(df) for category, df in self.categories.items()},
+        }
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_previous: Optional[Dict] = None
+# One reload at a time
+_reload_lock = threading.Lock()
+
+
+def current_snapshot() -> CatalogSnapshot:
+    global _snapshot
+    if _snapshot is None:
+        with _reload_lock:
+            if _snapshot is None:
+                _snapshot = CatalogSnapshot(source_version())
+    return _snapshot
+
+
+def previous_snapshot() -> Optional[Dict]:
+    return _previous
+
+
+# Build a snapshot of the scraped files (converting the new ones) off the request path, then swap it in
+# Returns the snapshot being served afterwards (the same one when nothing changed and not force)
+def reload_catalogs(categories: Optional[List[str]] = None, force: bool = False) -> CatalogSnapshot:
+    global _snapshot, _previous
+    with _reload_lock:
+        version = source_version()
+        if not force and _snapshot is not None and _snapshot.version == version and _snapshot.built_at is not None:
+            return _snapshot
+        print("Building catalog snapshot: ", version)
+        snapshot = CatalogSnapshot(version, categories or list(CATEGORY_FILES))
+        if _snapshot is not None:
+            _previous = _snapshot.info()
+        # Swapping the reference is atomic: a request gets either the old or the new snapshot, never a mix
+        _snapshot = snapshot
+        print("Catalog snapshot ", version, " served, built in ", round(snapshot.build_seconds, 2), "s")
+        return snapshot
+
+
+# Load every catalog once at process start so requests never parse files
+def preload_catalogs(categories: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+    return reload_catalogs(categories).categories
+
+
+def get_catalog(category: str) -> pd.DataFrame:
+    return current_snapshot().get_catalog(category)
+
+
+def get_name_index(category: str) -> NameIndex:
+    return current_snapshot().get_name_index(category)
+
+
+# Background thread that reloads the catalogs when a new scrape lands in Data/Woolies Extracted
+# Started per process (each forked worker has its own snapshot)
+class CatalogWatcher:
+    def __init__(self, poll_seconds: float = CATALOG_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.pid = None
+        self.errors = 0
+
+    def ensure_started(self):
+        if self.poll_seconds <= 0 or self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, name="catalog-watcher", daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                if source_version() != current_snapshot().version:
+                    reload_catalogs()
+            except Exception as e:
+                # Keep serving the current snapshot, try again at the next poll
+                self.errors += 1
+                print("Catalog reload failed: ", e)
+
+
+catalog_watcher = CatalogWatcher()
+
+
+# Refresh step: python catalog.py (after a new scrape)
+if __name__ == "__main__":
+    for category in CATEGORY_FILES:
+        convert_category(category, force=True)
+    for store, folder in [("woolies", "Woolies ID"), ("coles", "Coles ID")]:
+        folder = os.path.join(BASE_DIR, "Data", folder)
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.endswith(".csv"):
+                convert_csv(os.path.join(folder, file_name), store, force=True)
+    print("Finished")
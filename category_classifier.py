@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from catalog import CATEGORY_FILES, current_snapshot
+from name_index import tokenize
+from normalizer import normalize_ingredient
+
+# Ingredients classified with less confidence than this are left to ChatGPT
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", 0.6))
+# Set to 1 to classify the ingredients that aren't hard coded or learned before asking ChatGPT
+# Off by default: on the current catalogs it is confidently wrong for some produce (ex: tomatoes -> pantry),
+# check `python category_classifier.py` shows no disagreements at the chosen CLASSIFIER_MIN_CONFIDENCE first
+USE_CLASSIFIER = os.getenv("USE_CLASSIFIER", "0") == "1"
+
+
+# General category of an ingredient from the scraped catalogs, without ChatGPT
+# Every catalog file is one category, so the products are already labelled:
+# 1. votes of the products whose names contain the ingredient (ex: "soy sauce" -> 40 pantry products, 2 freezer products)
+# 2. no product has the whole name -> how often each word of it appears in the names of each category
+class CategoryClassifier:
+    def __init__(self, categories: List[str]):
+        self.categories = [category for category in categories if category in CATEGORY_FILES]
+        self.token_counts: Dict[str, Counter] = {}
+        self.lock = threading.Lock()
+        # Version of the catalog snapshot the counts were built from
+        self.version = None
+
+    # Word -> number of product names of each category that have it (built from the name indexes on first use,
+    # and again when a new catalog snapshot is served)
+    def build(self):
+        snapshot = current_snapshot()
+        with self.lock:
+            if self.version == snapshot.version:
+                return
+            token_counts = {}
+            for category in self.categories:
+                for token, rows in snapshot.get_name_index(category).postings.items():
+                    token_counts.setdefault(token, Counter())[category] += len(rows)
+            self.token_counts = token_counts
+            self.version = snapshot.version
+
+    # Products of each category that contain every word of the name
+    def votes(self, name: str) -> Counter:
+        votes = Counter()
+        snapshot = current_snapshot()
+        for category in self.categories:
+            hits = len(snapshot.get_name_index(category).lookup(name.split()))
+            if hits:
+                votes[category] = hits
+        return votes
+
+    # Share of each category in the names that have the words of the name, averaged over the words
+    def token_scores(self, name: str) -> Counter:
+        scores = Counter()
+        tokens = [token for token in tokenize(name) if token in self.token_counts]
+        for token in tokens:
+            counts = self.token_counts[token]
+            total = sum(counts.values())
+            for category, count in counts.items():
+                scores[category] += count / total / len(tokens)
+        return scores
+
+    # (category, confidence from 0 to 1). The category is None when nothing in the catalogs looks like the ingredient
+    def predict(self, ingredient: str) -> Tuple[Optional[str], float]:
+        self.build()
+        for name in dict.fromkeys([normalize_ingredient(ingredient), ingredient.lower()]):
+            votes = self.votes(name)
+            if votes:
+                category, count = votes.most_common(1)[0]
+                return category, count / sum(votes.values())
+        scores = self.token_scores(normalize_ingredient(ingredient))
+        if not scores:
+            return None, 0.0
+        category, score = scores.most_common(1)[0]
+        return category, score
+
+    # The category if the classifier is confident enough, None otherwise
+    def classify(self, ingredient: str, min_confidence: float = CLASSIFIER_MIN_CONFIDENCE) -> Optional[str]:
+        category, confidence = self.predict(ingredient)
+        return category if confidence >= min_confidence else None
+
+
+# How the classifier compares to ChatGPT's answers ({ingredient: category}, ex: what the category store learned)
+# coverage: share of the ingredients it is confident about, agreement: share of those where it gives ChatGPT's answer
+def agreement(classifier: CategoryClassifier, answers: Dict[str, str], min_confidence: float = CLASSIFIER_MIN_CONFIDENCE) -> Dict:
+    classified = 0
+    agreed = 0
+    per_category = {}
+    disagreements = []
+    for ingredient, expected in answers.items():
+        predicted = classifier.classify(ingredient, min_confidence)
+        stats = per_category.setdefault(expected, {"total": 0, "classified": 0, "agreed": 0})
+        stats["total"] += 1
+        if predicted is None:
+            continue
+        classified += 1
+        stats["classified"] += 1
+        if predicted == expected:
+            agreed += 1
+            stats["agreed"] += 1
+        else:
+            disagreements.append((ingredient, expected, predicted))
+    total = len(answers)
+    return {
+        "total": total,
+        "coverage": classified / total if total else 0.0,
+        "agreement": agreed / classified if classified else 0.0,
+        "accuracy": agreed / total if total else 0.0,
+        "per_category": per_category,
+        "disagreements": disagreements,
+    }
+
+
+# Benchmark against what ChatGPT answered so far: python category_classifier.py [categories.json]
+# (categories.json: {ingredient: category}, as written by python recipe.py export)
+if __name__ == "__main__":
+    import json
+    import sys
+
+    from recipe import CATEGORY_DICT, category_store
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            answers = json.load(f)
+    else:
+        answers = dict(category_store.categories)
+    classifier = CategoryClassifier(list(CATEGORY_DICT))
+    for min_confidence in [0.0, 0.5, CLASSIFIER_MIN_CONFIDENCE, 0.8]:
+        result = agreement(classifier, answers, min_confidence)
+        print(f"min confidence {min_confidence}: coverage {result['coverage']:.1%}, agreement {result['agreement']:.1%}, accuracy {result['accuracy']:.1%} ({result['total']} ingredients)")
+    result = agreement(classifier, answers)
+    for category, stats in sorted(result["per_category"].items()):
+        print(f"  {category}: {stats['agreed']}/{stats['classified']} agreed, {stats['classified']}/{stats['total']} classified")
+    for ingredient, expected, predicted in result["disagreements"]:
+        print(f"  {ingredient}: ChatGPT {expected}, classifier {predicted}")
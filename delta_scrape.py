@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from catalog import ID_COLUMNS
+from product_fetcher import FETCH_CONCURRENCY, FETCH_RATE, listing_files
+from scrape_jobs import CHECKPOINT_PATH, ITEM_DIR, ScrapeJob
+
+# Setup
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Folder and file name prefix of the ID scraper outputs of each store
+LISTING_DIRS = {
+    "woolies": (os.path.join(BASE_DIR, "Data", "Woolies ID"), "Woolies"),
+    "coles": (os.path.join(BASE_DIR, "Data", "Coles ID"), "Coles"),
+}
+# Stores whose product details can be scraped (Coles only has its listings)
+DETAIL_STORES = {"woolies"}
+# Details older than this are fetched again even if their listing didn't change
+STALE_DAYS = float(os.getenv("SCRAPE_STALE_DAYS", 30))
+# One JSON report per refresh
+REPORT_DIR = os.path.join(ITEM_DIR, "Changes")
+# Products listed per kind of change in a report (the counts are always complete)
+REPORT_MAX_ITEMS = int(os.getenv("SCRAPE_REPORT_MAX_ITEMS", 500))
+
+
+# The listing of a category (ID, Name, Price), one row per ID (the first file that has it wins)
+# Same files as the IDs of the scrape jobs (product_fetcher.category_ids)
+def read_listing(store: str, category: str) -> pd.DataFrame:
+    folder, prefix = LISTING_DIRS[store]
+    frames = [pd.read_csv(path, header=None, names=ID_COLUMNS[store], dtype=str, keep_default_na=False)
+              for path in listing_files(category, folder, prefix)]
+    if not frames:
+        raise FileNotFoundError(f"No {store} listing for {category} in {LISTING_DIRS[store][0]}")
+    df = pd.concat(frames, ignore_index=True)[["ID", "Name", "Price"]]
+    for column in df.columns:
+        df[column] = df[column].str.strip()
+    return df[df["ID"] != ""].drop_duplicates("ID").rename(columns={"ID": "Stockcode"}).reset_index(drop=True)
+
+
+# The listings of the last refresh of every (store, category), next to the scrape jobs
+class ListingStore:
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                store TEXT NOT NULL,
+                category TEXT NOT NULL,
+                stockcode TEXT NOT NULL,
+                name TEXT NOT NULL,
+                price TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                PRIMARY KEY (store, category, stockcode)
+            )
+        """)
+
+    def previous(self, store: str, category: str) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT stockcode AS Stockcode, name AS Name, price AS Price, first_seen FROM listings WHERE store = ? AND category = ?",
+            self.db, params=(store, category))
+
+    # Replace the listing of a category by the current one (first_seen is kept for the products still listed)
+    def save(self, store: str, category: str, listing: pd.DataFrame, first_seen: pd.Series):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM listings WHERE store = ? AND category = ?", (store, category))
+            self.db.executemany("INSERT INTO listings VALUES (?, ?, ?, ?, ?, ?)",
+                                zip([store] * len(listing), [category] * len(listing), listing["Stockcode"],
+                                    listing["Name"], listing["Price"], first_seen.astype(float)))
+
+    def close(self):
+        self.db.close()
+
+
+# Compare the current listing of a category to the previous one
+# fetched_at: {stockcode: when its detail was last fetched}. Details fetched before stale_before are stale
+# (None: the store has no details, nothing is stale)
+def diff_listing(previous: pd.DataFrame, current: pd.DataFrame, fetched_at: Optional[Dict[str, float]], stale_before: float) -> Dict[str, pd.DataFrame]:
+    merged = previous.merge(current, on="Stockcode", how="outer", suffixes=(" Old", ""), indicator=True)
+    listed = merged[merged["_merge"] != "left_only"]
+    both = listed[listed["_merge"] == "both"]
+    fetched = listed["Stockcode"].map(fetched_at or {})
+    return {
+        "new": listed[listed["_merge"] == "right_only"],
+        "removed": merged[merged["_merge"] == "left_only"],
+        "price_changed": both[both["Price Old"] != both["Price"]],
+        "name_changed": both[both["Name Old"] != both["Name"]],
+        # Never fetched (ex: new, or failed so far) or fetched too long ago
+        "stale": listed[fetched.isna() | (fetched < stale_before)] if fetched_at is not None else listed.head(0),
+    }
+
+
+def _records(df: pd.DataFrame, columns: Dict[str, str]) -> List[Dict]:
+    return df[list(columns)].rename(columns=columns).head(REPORT_MAX_ITEMS).to_dict("records")
+
+
+# Refresh one category from its latest listing: only the new products, the products whose price or name changed
+# and the stale details are fetched. The other details are still good from the previous scrapes
+# Returns the change report, also saved in Data/Woolies Item/Changes
+async def refresh_category(category: str, store: str = "woolies", stale_days: float = STALE_DAYS, fetch: bool = True,
+                           **fetcher_args) -> Dict:
+    start = time.time()
+    current = read_listing(store, category)
+    listings = ListingStore()
+    job = ScrapeJob(category) if store in DETAIL_STORES else None
+    try:
+        previous = listings.previous(store, category)
+        fetched_at = job.fetched_at() if job else None
+        changes = diff_listing(previous, current, fetched_at, start - stale_days * 24 * 3600)
+        to_fetch = []
+        if job:
+            to_fetch = list(dict.fromkeys(pd.concat([changes["price_changed"]["Stockcode"], changes["name_changed"]["Stockcode"],
+                                                     changes["stale"]["Stockcode"]])))
+        print(store, category, ": ", len(current), " listed, ", len(to_fetch), " to fetch")
+        progress = {}
+        if job and fetch and to_fetch:
+            job.requeue(to_fetch)
+            progress = await job.run(to_fetch, **fetcher_args)
+        fetched_now = job.fetched_at() if job else {}
+        fetched = [stockcode for stockcode in to_fetch if fetched_now.get(stockcode, 0) >= start]
+
+        # The products that couldn't be fetched keep their previous listing, so the next refresh sees the change again
+        saved = current.set_index("Stockcode")
+        kept = previous.set_index("Stockcode").loc[lambda df: df.index.isin(set(to_fetch) - set(fetched)) & df.index.isin(saved.index)]
+        saved.loc[kept.index, ["Name", "Price"]] = kept[["Name", "Price"]]
+        saved = saved.reset_index()
+        first_seen = saved["Stockcode"].map(dict(zip(previous["Stockcode"], previous["first_seen"]))).fillna(start)
+        if fetch or not job:
+            listings.save(store, category, saved, first_seen)
+    finally:
+        listings.close()
+        if job:
+            job.close()
+
+    report = {
+        "store": store,
+        "category": category,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+        "seconds": round(time.time() - start, 1),
+        "first_run": previous.empty,
+        "counts": {
+            "listed": len(current),
+            "previous": len(previous),
+            **{name: len(df) for name, df in changes.items()},
+            "to_fetch": len(to_fetch),
+            "fetched": len(fetched),
+            "not_fetched": len(to_fetch) - len(fetched),
+        },
+        "job": progress,
+        "new": _records(changes["new"], {"Stockcode": "stockcode", "Name": "name", "Price": "price"}),
+        "removed": _records(changes["removed"], {"Stockcode": "stockcode", "Name Old": "name", "Price Old": "price"}),
+        "price_changed": _records(changes["price_changed"], {"Stockcode": "stockcode", "Name": "name", "Price Old": "old", "Price": "new"}),
+        "name_changed": _records(changes["name_changed"], {"Stockcode": "stockcode", "Name Old": "old", "Name": "new"}),
+        "not_fetched": [stockcode for stockcode in to_fetch if stockcode not in set(fetched)][:REPORT_MAX_ITEMS],
+    }
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_DIR, f"{store} {category} {time.strftime('%Y%m%d-%H%M%S', time.localtime(start))}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(store, category, ": ", report["counts"], " report: ", path)
+    return report
+
+
+# Refresh after a new run of the ID scrapers:
+#   python delta_scrape.py pantry bakery             (Woolies: fetches what changed)
+#   python delta_scrape.py Pantry Bakery --store coles  (change report only)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental refresh of the scraped product details")
+    parser.add_argument("categories", nargs="+")
+    parser.add_argument("--store", choices=list(LISTING_DIRS), default="woolies")
+    parser.add_argument("--stale-days", type=float, default=STALE_DAYS, help="fetch details older than this again")
+    parser.add_argument("--report-only", action="store_true", help="compare the listings without fetching")
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=FETCH_RATE, help="requests per second (0: no limit)")
+    args = parser.parse_args()
+    for category in args.categories:
+        asyncio.run(refresh_category(category, args.store, args.stale_days, not args.report_only,
+                                     concurrency=args.concurrency, rate=args.rate))
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from catalog import CATEGORY_FILES, extracted_path
+from ingredient_filter import RULES, VERDICT_COLUMNS, compute_verdicts
+from raw_store import decode_record, index_path, read_index, rebuild_index
+from scrape_jobs import item_path
+
+# Processes parsing the raw details (1 -> in this process)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1))
+# Records per chunk: the memory used is about (2 x workers + 1) chunks, whatever the size of the category
+EXTRACT_CHUNK_ROWS = int(os.getenv("EXTRACT_CHUNK_ROWS", 500))
+
+# The fields we use: (column, where it is in the product detail, key)
+FIELDS = [
+    ("Product Name", ("Product",), "Name"),
+    ("Display Name", ("Product",), "DisplayName"),
+    ("Stockcode", ("Product",), "Stockcode"),
+    ("Barcode", ("Product",), "Barcode"),
+    ("Medium Image File", ("Product",), "MediumImageFile"),
+    ("Cup Measure", ("Product",), "CupMeasure"),
+    ("Price", ("Product",), "Price"),
+    ("Cup Price", ("Product",), "CupPrice"),
+    ("Cup String", ("Product",), "CupString"),
+    ("Has Cup Price", ("Product",), "HasCupPrice"),
+    ("Package Size", ("Product",), "PackageSize"),
+    ("Sap Department Name", ("Product", "SapCategories"), "SapDepartmentName"),
+    ("Sap Category Name", ("Product", "SapCategories"), "SapCategoryName"),
+    ("Sap Sub Category Name", ("Product", "SapCategories"), "SapSubCategoryName"),
+    ("Sap Segment Name", ("Product", "SapCategories"), "SapSegmentName"),
+    ("Department", ("PrimaryCategory",), "Department"),
+    ("Aisle", ("PrimaryCategory",), "Aisle"),
+    ("Description", ("AdditionalAttributes",), "description"),
+    ("Vegetarian", ("AdditionalAttributes",), "vegetarian"),
+    ("Wool Dietary Claim", ("AdditionalAttributes",), "wool_dietaryclaim"),
+    ("Allergen Contains", ("AdditionalAttributes",), "allergencontains"),
+    ("Allergy Statement", ("AdditionalAttributes",), "allergystatement"),
+    ("Ingredients", ("AdditionalAttributes",), "ingredients"),
+]
+# Same column types as the catalogs converted from the XLSX files (the other columns are strings)
+TYPES = {
+    "Stockcode": pa.int64(),
+    "Barcode": pa.int64(),
+    "Price": pa.float64(),
+    "Cup Price": pa.float64(),
+    "Has Cup Price": pa.bool_(),
+    "Vegetarian": pa.bool_(),
+}
+SCHEMA = pa.schema(
+    [(column, TYPES.get(column, pa.string())) for column, _, _ in FIELDS]
+    + [(column, pa.uint64() if column == "Bad Mask" else pa.int64()) for column in VERDICT_COLUMNS],
+    # The bad list of the verdicts, like the converted catalogs: load_catalog doesn't compute them again
+    metadata={"bad_list": json.dumps(RULES)},
+)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "y", "1")
+    return bool(value)
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+CONVERTERS = {pa.int64(): _to_int, pa.float64(): _to_float, pa.bool_(): _to_bool, pa.string(): _to_str}
+
+
+# The values of the columns of FIELDS for one product detail
+def project(detail: Dict) -> List[Any]:
+    sections = {}
+    values = []
+    for column, path, key in FIELDS:
+        if path not in sections:
+            section = detail
+            for name in path:
+                section = (section or {}).get(name) or {}
+            sections[path] = section
+        values.append(CONVERTERS[TYPES.get(column, pa.string())](sections[path].get(key)))
+    return values
+
+
+# One chunk of records of a raw file ([(offset, length)]) -> a record batch in the catalog format and the number
+# of records that couldn't be decoded (skipped, the rest of the category is still extracted)
+# Runs in the worker processes: each one reads and decompresses its own records, only the batch comes back
+def extract_chunk(path: str, ranges: List[Tuple[int, int]]) -> Tuple[pa.RecordBatch, int]:
+    rows = []
+    errors = 0
+    with open(path, "rb") as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            try:
+                _, detail = decode_record(f.read(length))
+            except (zlib.error, EOFError, OSError, json.JSONDecodeError, KeyError) as e:
+                errors += 1
+                print("Invalid record at ", offset, ": ", repr(e))
+                continue
+            if detail and detail.get("Product"):
+                rows.append(project(detail))
+    columns = list(zip(*rows)) or [[] for _ in FIELDS]
+    arrays = [pa.array(values, type=TYPES.get(column, pa.string())) for (column, _, _), values in zip(FIELDS, columns)]
+    ingredients = pd.Series(columns[[column for column, _, _ in FIELDS].index("Ingredients")], dtype=object)
+    verdicts = compute_verdicts(ingredients)
+    arrays += [pa.array(verdicts[column].to_numpy(), type=SCHEMA.field(column).type) for column in VERDICT_COLUMNS]
+    return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA), errors
+
+
+# The current record of every product (a product fetched again, ex: by a delta refresh, has its last record
+# in the index) in chunks of chunk_rows, in the order of the file
+def iter_chunks(path: str, chunk_rows: int = EXTRACT_CHUNK_ROWS) -> Iterator[List[Tuple[int, int]]]:
+    ranges = sorted(read_index(path).values())
+    for start in range(0, len(ranges), chunk_rows):
+        yield ranges[start:start + chunk_rows]
+
+
+# Extract the raw details of a category (Data/Woolies Item) into its catalog format (Data/Woolies Extracted)
+# The chunks are parsed by a pool of processes and written in order as record batches as soon as they're ready:
+# at most 2 chunks per worker are in flight, so the memory doesn't grow with the category
+# The catalogs pick up the new file at their next reload: the target is only replaced by a file that has products
+def extract_category(category: str, source: Optional[str] = None, target: Optional[str] = None,
+                     workers: int = EXTRACT_WORKERS, chunk_rows: int = EXTRACT_CHUNK_ROWS) -> Dict[str, int]:
+    source = source or item_path(category)
+    target = target or extracted_path(category)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"No raw details for {category}: {source}")
+    if not os.path.exists(index_path(source)):
+        print(category, ": no index, rebuilding it from ", source)
+        rebuild_index(source)
+    stats = {"rows": 0, "errors": 0, "chunks": 0}
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+
+    def write(batch: pa.RecordBatch, errors: int):
+        writer.write_batch(batch)
+        stats["rows"] += batch.num_rows
+        stats["errors"] += errors
+        stats["chunks"] += 1
+
+    try:
+        # Uncompressed Arrow file, like the converted catalogs: it can be memory-mapped as is
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+            if workers <= 1:
+                for chunk in iter_chunks(source, chunk_rows):
+                    write(*extract_chunk(source, chunk))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pending = deque()
+                    for chunk in iter_chunks(source, chunk_rows):
+                        pending.append(pool.submit(extract_chunk, source, chunk))
+                        if len(pending) >= 2 * workers:
+                            write(*pending.popleft().result())
+                    while pending:
+                        write(*pending.popleft().result())
+        # An empty category would be served as is by the next reload
+        if not stats["rows"]:
+            raise ValueError(f"No products extracted from {source} ({stats}), {target} not replaced")
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(category, ": ", stats, " in ", round(time.perf_counter() - start, 1), "s -> ", target)
+    return stats
+
+
+# After a scrape: python extract_items.py [categories]  (default: every category that has raw details)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the scraped product details into the catalog format")
+    parser.add_argument("categories", nargs="*")
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS)
+    parser.add_argument("--chunk-rows", type=int, default=EXTRACT_CHUNK_ROWS)
+    args = parser.parse_args()
+    categories = args.categories or [category for category in CATEGORY_FILES if os.path.exists(item_path(category))]
+    for category in categories:
+        extract_category(category, workers=args.workers, chunk_rows=args.chunk_rows)
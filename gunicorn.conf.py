@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+# Production serving: gunicorn -c gunicorn.conf.py app:app
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Requests are thread safe (immutable rule sets, read-only catalogs) -> several threads per worker
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+# Import app.py (catalog loading + warm-up) once in the master, then fork the workers:
+# they share the catalog pages instead of loading a copy each
+preload_app = True
+# The LLM calls can take a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+
+def when_ready(server):
+    server.log.info("Catalogs loaded and warmed up, forking %s workers", workers)
+
+
+# The worker is forked: the SQLite connections, the LLM event loop and the search pools are
+# reopened by the os.register_at_fork hooks of llm.py, recipe.py and product_search.py
+def post_fork(server, worker):
+    server.log.info("Worker %s ready", worker.pid)
@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import aiohttp
+import openai
+from dotenv import load_dotenv
+
+# Setup
+load_dotenv()
+GPT_MODEL = "gpt-3.5-turbo"
+openai.api_key = os.getenv("OPENAI_API_KEY")
+SYSTEM_PROMPT = "Output only valid JSON"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "Data", "Cache")
+# Responses older than this are asked again
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))
+# Size of the on-disk cache before the least recently used responses are removed
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+# Number of responses kept in memory
+CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", 1024))
+# Seconds a caller waits for an answer before giving up
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+# Requests sent to the API at the same time, by this process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+# Retries of a failed request (rate limit, server error, invalid JSON...)
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", 2))
+# A duplicate request is sent when the first one is slower than this percentile of the recent latencies
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+# Latencies needed before hedging starts
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+# Errors worth another try
+RETRY_ERRORS = (openai.error.Timeout, openai.error.APIError, openai.error.APIConnectionError, openai.error.RateLimitError,
+                openai.error.ServiceUnavailableError, openai.error.TryAgain, aiohttp.ClientError, json.JSONDecodeError)
+
+
+# Cache of LLM responses keyed by the hash of (model, prompt, temperature)
+# 2 tiers: an in-memory LRU in front of a SQLite file shared by every process
+class LLMCache:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "llm.sqlite"), memory_size: int = CACHE_MEMORY_SIZE,
+                 max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.reopen()
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    # A SQLite connection can't be used across fork: each worker process opens its own
+    def reopen(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+    @staticmethod
+    def key(model: str, prompt: str, temperature: float) -> str:
+        content = json.dumps([model, SYSTEM_PROMPT, prompt, temperature])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                created, response = self.memory[key]
+                if now - created < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return response
+                del self.memory[key]
+            row = self.db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self._remember(key, row[1], row[0])
+            self.stats["disk_hits"] += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self._remember(key, now, response)
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, response, len(response.encode()), now, now))
+            self._evict(now)
+
+    def _remember(self, key: str, created: float, response: str):
+        self.memory[key] = (created, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    # Remove the expired responses, then the least recently used ones until the file is under max_bytes
+    def _evict(self, now: float):
+        self.stats["evictions"] += self.db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,)).rowcount
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.memory.pop(key, None)
+            self.stats["evictions"] += 1
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.db.execute("DELETE FROM responses")
+
+
+cache = LLMCache()
+os.register_at_fork(after_in_child=cache.reopen)
+
+
+# Asyncio client in front of the ChatCompletion API
+# - identical prompts in flight share one request (single-flight)
+# - every caller has a deadline; the request keeps going for the others and for the cache
+# - a duplicate request is sent when the first one is slower than the p95 latency, the first answer wins (hedging)
+# - at most max_concurrency requests at the same time
+# It runs on its own event loop thread so the sync code (Flask, Streamlit) shares the in-flight requests
+# Point it at the local stub server with OPENAI_API_BASE=http://127.0.0.1:8001/v1 (python llm_stub.py)
+class AsyncLLMClient:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT, retries: int = LLM_RETRIES,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE, hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=500)
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "coalesced": 0, "hedges": 0, "hedge_wins": 0, "retries": 0, "timeouts": 0, "errors": 0}
+        self.loop = None
+        self.semaphore = None
+        self.session = None
+        self.lock = threading.Lock()
+
+    # The event loop thread doesn't survive fork: a new process starts its own on first use
+    def reset(self):
+        self.loop = None
+        self.semaphore = None
+        self.session = None
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    # Event loop thread, started on first use
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm", daemon=True).start()
+                self.loop = loop
+        return self.loop
+
+    # Run a coroutine of this client from sync code
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop()).result()
+
+    # Wait for the first request longer than this before sending a duplicate (None: not enough latencies yet)
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile <= 0 or len(self.latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    async def _complete(self, model: str, prompt: str, temperature: float) -> str:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.session = aiohttp.ClientSession()
+        async with self.semaphore:
+            # One connection pool for every request of the client
+            openai.aiosession.set(self.session)
+            self.stats["requests"] += 1
+            start = time.perf_counter()
+            completion = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=temperature,
+                request_timeout=self.timeout,
+            )
+            self.latencies.append(time.perf_counter() - start)
+        text = completion.choices[0].message.content
+        # Only valid JSON is an answer
+        json.loads(text)
+        return text
+
+    # One request, plus a duplicate if it is slower than usual. The first answer wins, the other request is cancelled
+    async def _hedged(self, model: str, prompt: str, temperature: float) -> str:
+        first = asyncio.create_task(self._complete(model, prompt, temperature))
+        tasks = {first}
+        delay = self.hedge_delay()
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.stats["hedges"] += 1
+                    tasks.add(asyncio.create_task(self._complete(model, prompt, temperature)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch(self, key: str, model: str, prompt: str, temperature: float) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                text = await self._hedged(model, prompt, temperature)
+                print(text)
+                cache.set(key, text)
+                return text
+            except RETRY_ERRORS as e:
+                if attempt == self.retries:
+                    self.stats["errors"] += 1
+                    raise
+                self.stats["retries"] += 1
+                print("LLM request failed, retrying: ", type(e).__name__)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def json_gpt(self, input: str, temperature: float = 0.5, model: str = GPT_MODEL, use_cache: bool = True,
+                       timeout: Optional[float] = None) -> Dict:
+        key = LLMCache.key(model, input, temperature)
+        text = cache.get(key) if use_cache else None
+        if text is not None:
+            return json.loads(text)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, model, input, temperature))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            # shield: a caller giving up doesn't cancel the request of the others
+            text = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise TimeoutError(f"No answer from {model} in {timeout}s")
+        return json.loads(text)
+
+
+client = AsyncLLMClient()
+os.register_at_fork(after_in_child=client.reset)
+
+
+# ChatGPT setup to return JSON formatted data. Identical prompts are answered from the cache
+# timeout: seconds to wait for the answer (default LLM_TIMEOUT), TimeoutError after that
+def json_gpt(input: str, temperature: float = 0.5, model: str = GPT_MODEL, use_cache: bool = True, timeout: Optional[float] = None) -> Dict:
+    return client.run(client.json_gpt(input, temperature, model, use_cache, timeout))
@@ -0,0 +1,95 @@
+import argparse
+import ast
+import asyncio
+import json
+import random
+import re
+import time
+
+from aiohttp import web
+
+# Local stand-in for the ChatCompletion API, to try the LLM client without an API key or cost:
+#   python llm_stub.py --delay 0.2 --slow-rate 0.1 --slow-delay 3
+#   OPENAI_API_BASE=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python app.py
+# GET /stats -> number of requests received (ex: to check identical prompts were coalesced)
+
+
+# Lines of the recipe in the prompt without the quantities (ex: "2 tbsp oil" -> "oil")
+def recipe_ingredients(prompt: str) -> list:
+    recipe = prompt.split("This is the recipe:", 1)[1].split("Only include", 1)[0]
+    lines = [re.sub(r"^[\d/.\s]*(tbsp|tsp|cups?|g|kg|ml)?\s+", "", line.strip()) for line in recipe.splitlines()]
+    return [line for line in lines if line]
+
+
+# Answers in the formats the prompts of recipe.py ask for
+def answer(prompt: str) -> dict:
+    # Combined extraction (EXTRACTION_MODE=combined): the ingredients already grouped by category
+    if "group them into their respective categories" in prompt:
+        ingredients = recipe_ingredients(prompt)
+        return {"pantry": ingredients} if ingredients else {}
+    if "Get all the ingredients" in prompt:
+        return {"Ingredients": recipe_ingredients(prompt)}
+    if "Group the items" in prompt:
+        items = ast.literal_eval(re.search(r"Items: (\[.*\])", prompt).group(1))
+        return {"pantry": items} if items else {}
+    return {}
+
+
+class StubServer:
+    def __init__(self, delay: float, jitter: float, slow_rate: float, slow_delay: float, error_rate: float,
+                 throttle_rate: float = 0.0):
+        self.delay = delay
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+    # Seconds before answering the request number `count` (from 1)
+    def request_delay(self, count: int) -> float:
+        return self.slow_delay if random.random() < self.slow_rate else self.delay + random.uniform(0, self.jitter)
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.request_delay(self.stats["requests"]))
+        if random.random() < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return web.json_response({"error": {"message": "Stub rate limit", "type": "requests"}}, status=429,
+                                     headers={"Retry-After": "1"})
+        if random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "Stub server error", "type": "server_error"}}, status=500)
+        content = json.dumps(answer(body["messages"][-1]["content"]))
+        return web.json_response({
+            "id": f"chatcmpl-stub-{self.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ChatCompletion stub server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.1, help="random extra seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of the requests answered after --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of the requests answered with a 429")
+    args = parser.parse_args()
+    server = StubServer(args.delay, args.jitter, args.slow_rate, args.slow_delay, args.error_rate, args.throttle_rate)
+    web.run_app(server.app(), host="127.0.0.1", port=args.port)
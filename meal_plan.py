@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from ingredient_filter import RULE_SET, RuleSet
+from normalizer import normalize_ingredient
+from product_search import SEARCH_WORKERS, iter_search, merge_results, search_tasks, skip_ingredient
+from recipe import categorize_ingredients, get_recipe_ingredients
+
+# not_found key of the recipe ingredients that none of the categorized items matches
+UNMATCHED = "uncategorized"
+
+
+# The ingredients of every recipe. The recipes are sent to ChatGPT at the same time
+def extract_ingredients(recipes: Dict[str, str], workers: int = SEARCH_WORKERS) -> Dict[str, List[str]]:
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(recipes)))) as pool:
+        ingredients = pool.map(get_recipe_ingredients, recipes.values())
+        return dict(zip(recipes, ingredients))
+
+
+# The categorized items of one recipe, out of the categorized items of all of them, and the ingredients of the recipe
+# that none of them matches (ex: dropped by ChatGPT). Matched by normalized name: ChatGPT can rename or re-spell
+# an item when it categorizes it (ex: "Tomatoes" -> "tomato")
+def recipe_items(categorized_items: Dict[str, List[str]], ingredients: List[str]) -> Tuple[Dict[str, List[str]], List[str]]:
+    names = {normalize_ingredient(ingredient.lower()): ingredient for ingredient in ingredients}
+    matched = set()
+    items = {}
+    for k, v in categorized_items.items():
+        products = []
+        for product in v:
+            name = normalize_ingredient(product.lower())
+            if name in names:
+                products.append(product)
+                matched.add(name)
+        if products:
+            items[k] = products
+    unmatched = [ingredient for name, ingredient in names.items() if name not in matched and not skip_ingredient(ingredient)]
+    return items, unmatched
+
+
+# Products of several recipes (ex: a weekly meal plan, {recipe name: recipe}) for the cost of their distinct ingredients:
+# the ingredients of all the recipes are categorized in one go and each (normalized ingredient, category) is searched once
+# Returns {recipe name: {"all_res", "buy_list", "not_found"}} and the combined results of all the recipes
+def search_recipes(recipes: Dict[str, str], top: Optional[int] = 5, bad_list: RuleSet = RULE_SET,
+                   workers: Optional[int] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    workers = SEARCH_WORKERS if workers is None else workers
+    ingredients = extract_ingredients(recipes, workers)
+    # Union of the ingredients (ex: garlic in 5 recipes -> categorized once)
+    all_ingredients = list(dict.fromkeys(ingredient for values in ingredients.values() for ingredient in values))
+    print("Ingredients: ", len(all_ingredients), "distinct out of", sum(len(values) for values in ingredients.values()))
+    categorized_items = categorize_ingredients(all_ingredients)
+
+    # Search each (normalized ingredient, category) once (ex: "Garlic cloves" and "garlic clove" are the same search)
+    tasks = search_tasks(categorized_items)
+    unique = {}
+    for product, k in tasks:
+        unique.setdefault((normalize_ingredient(product), k), (product, k))
+    unique_tasks = list(unique.values())
+    print("Searches: ", len(unique_tasks))
+    found = {}
+    for index, result in iter_search(unique_tasks, top, bad_list, workers=workers):
+        found[unique_tasks[index]] = result
+
+    # Fan the results back out: each item keeps the name it has in its recipe
+    def results_of(item_tasks: List[Tuple[str, str]]) -> List[Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        results = []
+        for product, k in item_tasks:
+            representative = unique[(normalize_ingredient(product), k)]
+            name, records, cheapest = found[representative]
+            results.append((product if name == representative[0] else name, records, cheapest))
+        return results
+
+    per_recipe = {}
+    all_unmatched = []
+    for recipe_name, values in ingredients.items():
+        items, unmatched = recipe_items(categorized_items, values)
+        recipe_tasks = search_tasks(items)
+        all_res, buy_list, all_none = merge_results(recipe_tasks, results_of(recipe_tasks))
+        if unmatched:
+            print(recipe_name, ": ingredients not categorized: ", unmatched)
+            all_none[UNMATCHED] = unmatched
+            all_unmatched += unmatched
+        per_recipe[recipe_name] = {"all_res": all_res, "buy_list": buy_list, "not_found": all_none}
+    # Combined shopping list: one product per distinct ingredient
+    all_res, buy_list, all_none = merge_results(unique_tasks, results_of(unique_tasks))
+    if all_unmatched:
+        all_none[UNMATCHED] = list(dict.fromkeys(all_unmatched))
+    combined = {"all_res": all_res, "buy_list": buy_list, "not_found": all_none}
+    return per_recipe, combined
@@ -0,0 +1,52 @@
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# Same notion of a word as \b in the regex the index replaces
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+
+# Word-level inverted index over product names: token -> sorted row positions
+# Looking up "soba noodles" = intersecting the rows of "soba" and "noodles"
+class NameIndex:
+    def __init__(self, names: pd.Series):
+        postings = defaultdict(list)
+        for position, name in enumerate(names):
+            if not isinstance(name, str):
+                continue
+            for token in set(tokenize(name)):
+                postings[token].append(position)
+        self.names = names
+        self.size = len(names)
+        self.postings: Dict[str, np.ndarray] = {token: np.array(rows, dtype=np.int64) for token, rows in postings.items()}
+
+    def rows(self, token: str) -> np.ndarray:
+        return self.postings.get(token, np.empty(0, dtype=np.int64))
+
+    # Positions of the names that contain every keyword as a whole word (like str.contains(fr'\b{keyword}\b', case=False))
+    def lookup(self, keywords: Iterable[str]) -> np.ndarray:
+        result = None
+        to_verify = []
+        for keyword in keywords:
+            tokens = tokenize(keyword)
+            # Ex: "all-purpose" -> the index narrows down to names with "all" and "purpose", the regex checks the rest
+            if len(tokens) != 1 or tokens[0] != keyword.lower():
+                to_verify.append(keyword)
+            for token in tokens:
+                rows = self.rows(token)
+                result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+                if len(result) == 0:
+                    return result
+        if result is None:
+            result = np.arange(self.size)
+        for keyword in to_verify:
+            names = self.names.iloc[result]
+            result = result[names.str.contains(fr"\b{re.escape(keyword)}\b", case=False, na=False).to_numpy()]
+        return result
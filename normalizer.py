@@ -0,0 +1,61 @@
+import os
+from functools import lru_cache
+
+import inflect
+
+p = inflect.engine()
+# Number of raw ingredient strings remembered by each normalization step
+NORMALIZE_CACHE_SIZE = int(os.getenv("NORMALIZE_CACHE_SIZE", 10000))
+
+# HARD CODE: rewrite rules, applied in order to the ingredient as written in the recipe
+# ("rename", words, new name): the ingredient becomes the new name when it contains all the words
+# ("replace", word, new word): the word is replaced everywhere in the ingredient
+REWRITE_RULES = [
+    ("rename", ("scallion",), "spring onion"),
+    ("rename", ("ketchup",), "tomato sauce"),
+    ("replace", "ground", "mince"),
+    ("rename", ("raising", "flour"), "raising flour"),
+    ("rename", ("self-raising",), "raising flour"),
+] + [
+    # all_replace: keep only the main word (ex: "grated parmesan cheese" -> "parmesan")
+    ("rename", (word,), word) for word in ["parmesan", "cheddar", "basil", "oregano", "pepper flakes", "spaghetti"]
+]
+# Words that don't help finding the product, removed wherever they are
+WORDS_TO_REMOVE = ("dry", "chopped", "shred", "shredded", "diced", "sliced", "grated", "cubed", "julienne", "pureed", "mashed", "leaves", "crushed", "sliced", "whole", "boneless")
+# Default: the ingredient is made singular. Products with these words are sold under the plural name
+WORDS_TO_PLURALIZE = frozenset(["noodle", "egg"])
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def singular(ingredient: str) -> str:
+    return p.singular_noun(ingredient.lower()) or ingredient.lower()
+
+
+# Convert plural to singular and vice versa
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def convert_plural_singular(word: str) -> str:
+    if p.singular_noun(word):
+        return p.singular_noun(word)
+    elif p.plural_noun(word):
+        return p.plural_noun(word)
+    else:
+        return word
+
+
+# The name to look up in the catalog for an ingredient (ex: "Chopped scallions" -> ..., "ground beef" -> "mince beef")
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_ingredient(product: str) -> str:
+    for kind, match, new in REWRITE_RULES:
+        if kind == "rename" and all(word in product for word in match):
+            product = new
+        elif kind == "replace" and match in product:
+            product = product.replace(match, new)
+
+    for word in WORDS_TO_REMOVE:
+        if word in product:
+            product = product.replace(word, "")
+
+    product = singular(product).strip()
+    if not WORDS_TO_PLURALIZE.isdisjoint(product.split()):
+        product = p.plural(product)
+    return product
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+
+# Setup
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ID_DIR = os.path.join(BASE_DIR, "Data", "Woolies ID")
+# Raw responses saved with record_dir (python scrape_jobs.py bakery --record), served back by woolies_stub.py
+RECORDED_DIR = os.path.join(BASE_DIR, "Data", "Woolies Recorded")
+# Set to the stub server to scrape without hitting the website (ex: http://127.0.0.1:8002)
+WOOLIES_BASE_URL = os.getenv("WOOLIES_BASE_URL", "https://www.woolworths.com.au")
+DETAIL_PATH = "/apis/ui/product/detail/{}?isMobile=false&useVariant=true"
+# Requests in flight at the same time (also the size of the connection pool)
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 8))
+# Requests started per second on average, and how many can start at once after a quiet period
+FETCH_RATE = float(os.getenv("FETCH_RATE", 5))
+FETCH_BURST = int(os.getenv("FETCH_BURST", 10))
+# Same defaults as new_session in Trash/session.py: 5s timeout, 3 retries with a backoff factor of 1
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 5))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", 3))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", 1))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Outcome of fetching one product
+FETCHED = "done"
+NOT_FOUND = "missing"
+FAILED = "failed"
+HEADERS = {"User-Agent": "coles_vs_woolies", "Accept": "application/json"}
+
+
+# Rate limit shared by every request of a fetcher: `rate` tokens are added per second, up to `capacity`
+# A request takes one token, and waits for it when the bucket is empty
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # The lock keeps the waiters in order: the first one gets the next token
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # The server asked to slow down (ex: 429): nobody starts a request for `seconds`
+    def pause(self, seconds: float):
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+# Product details from the JSON endpoint the website uses, without a browser
+# One pooled HTTP session for every request, at most `concurrency` requests in flight and `rate` started per second
+# Failed requests (timeouts, connection errors, 429 and 5xx) are retried with an exponential backoff
+#   async with ProductFetcher() as fetcher:
+#       async for stockcode, outcome, data in fetcher.iter_fetch(ids):
+class ProductFetcher:
+    def __init__(self, base_url: str = WOOLIES_BASE_URL, concurrency: int = FETCH_CONCURRENCY, rate: float = FETCH_RATE,
+                 burst: int = FETCH_BURST, timeout: float = FETCH_TIMEOUT, retries: int = FETCH_RETRIES,
+                 backoff: float = FETCH_BACKOFF, record_dir: Optional[str] = None):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.record_dir = record_dir
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.bucket: Optional[TokenBucket] = None
+        self.stats = {"requests": 0, "fetched": 0, "retries": 0, "throttled": 0, "not_found": 0, "errors": 0}
+
+    async def __aenter__(self) -> "ProductFetcher":
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.bucket = TokenBucket(self.rate, self.burst)
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+        # Mimic customer action: the home page sets the cookies the API expects
+        try:
+            async with self.session.get(self.base_url + "/") as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print("Home page failed: ", e)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def backoff_delay(self, attempt: int) -> float:
+        # 1s, 2s, 4s... with some jitter so the retries of a burst don't all come back at once
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    # The detail of one product, None if it doesn't exist (404) or still fails after the retries
+    async def fetch(self, stockcode: str) -> Optional[Dict]:
+        return (await self.fetch_status(stockcode))[1]
+
+    # (FETCHED, detail), (NOT_FOUND, None) or (FAILED, None)
+    async def fetch_status(self, stockcode: str) -> Tuple[str, Optional[Dict]]:
+        url = self.base_url + DETAIL_PATH.format(stockcode)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            delay = self.backoff_delay(attempt)
+            try:
+                async with self.session.get(url) as response:
+                    if response.status == 404:
+                        self.stats["not_found"] += 1
+                        return NOT_FOUND, None
+                    if response.status in RETRY_STATUSES:
+                        if response.status == 429:
+                            self.stats["throttled"] += 1
+                            retry_after = response.headers.get("Retry-After", "")
+                            delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else delay
+                            self.bucket.pause(delay)
+                        print("Retrying ", stockcode, ": status ", response.status)
+                        await asyncio.sleep(delay)
+                        continue
+                    response.raise_for_status()
+                    body = await response.text()
+                    data = json.loads(body)
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+                print("Retrying ", stockcode, ": ", repr(e))
+                await asyncio.sleep(delay)
+                continue
+            if self.record_dir:
+                with open(os.path.join(self.record_dir, f"{stockcode}.json"), "w") as f:
+                    f.write(body)
+            self.stats["fetched"] += 1
+            return FETCHED, data
+        self.stats["errors"] += 1
+        print("Failed: ", stockcode)
+        return FAILED, None
+
+    # Fetch every stockcode and yield (stockcode, outcome, detail or None) as each one finishes
+    # A fixed number of workers take the stockcodes from a queue, so a category of 5000 IDs is not 5000 tasks
+    async def iter_fetch(self, stockcodes: Iterable[str]) -> AsyncIterator[Tuple[str, str, Optional[Dict]]]:
+        todo = asyncio.Queue()
+        for stockcode in stockcodes:
+            todo.put_nowait(str(stockcode))
+        done = asyncio.Queue()
+
+        async def worker():
+            while True:
+                try:
+                    stockcode = todo.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await done.put((stockcode, *await self.fetch_status(stockcode)))
+
+        total = todo.qsize()
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.concurrency, total))]
+        try:
+            for _ in range(total):
+                yield await done.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+
+# ID scraper outputs of a category, in file order. A category scraped in several runs has several files
+# (ex: "Woolies pantry.csv", "Woolies 1 pantry.csv", "Woolies 46 Pantry pantry.csv", or "Coles 117 Pantry.csv" in Data/Coles ID)
+# Every reader of the listings (the scrape jobs, the delta refresh) picks the files of a category with this
+def listing_files(category: str, folder: str = ID_DIR, prefix: str = "Woolies") -> List[str]:
+    return [os.path.join(folder, file_name) for file_name in sorted(os.listdir(folder))
+            if file_name == f"{prefix} {category}.csv"
+            or (file_name.startswith(f"{prefix} ") and file_name.endswith(f" {category}.csv"))]
+
+
+# IDs of a category from the ID scraper outputs (first column, no header)
+# The IDs of its files are merged in file order without duplicates
+def category_ids(category: str) -> List[str]:
+    ids = []
+    for path in listing_files(category, ID_DIR):
+        df = pd.read_csv(path, header=None, dtype=str)
+        ids += df.iloc[:, 0].dropna().str.strip().tolist()
+    return list(dict.fromkeys(ids))
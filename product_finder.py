@@ -0,0 +1,148 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from catalog import get_name_index
+from name_index import NameIndex
+from ingredient_filter import RULE_SET, RuleSet, as_rule_set, clean_mask
+from normalizer import normalize_ingredient
+
+PRODUCT_URL = "https://www.woolworths.com.au/shop/productdetails/{}"
+# Catalog columns kept in the result -> their names in the result
+RESULT_COLUMNS = {
+    "Product Name": "Product Name",
+    "Ingredients": "Ingredients",
+    "Cup Price": "Cup Price",
+    "Price": "Price",
+    "Stockcode": "Stockcode",
+    "Medium Image File": "Image",
+    "Cup Measure": "Cup",
+}
+# Result columns -> keys of the json records
+RECORD_KEYS = {
+    "Product Name": "product_name",
+    "Ingredients": "ingredients",
+    "Cup Price": "cup_price",
+    "Price": "price",
+    "Stockcode": "stockcode",
+    "Image": "image",
+    "Cup": "cup",
+}
+
+
+# Lower-cased values of a catalog column for the given rows (NaN stays NaN)
+def _lower(df: pd.DataFrame, column: str, positions: np.ndarray) -> np.ndarray:
+    return pd.Series(df[column].to_numpy()[positions], dtype=object).str.lower().to_numpy()
+
+
+# Indices of the k smallest values in order, ties kept in their original order (same as a stable sort + head(k))
+# Partial selection: only the values up to the k-th smallest get sorted, not all of them
+def top_k(values: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    if k is None or k >= len(values):
+        return np.argsort(values, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(values, k - 1)[k - 1]
+    # Less than k real prices -> NaN is the k-th value, sort everything
+    if np.isnan(kth):
+        return np.argsort(values, kind="stable")[:k]
+    candidates = np.flatnonzero(values <= kth)
+    return candidates[np.argsort(values[candidates], kind="stable")][:k]
+
+
+# Rank rows of df: the top k by `by` (cheapest unit price), and which of those is the lowest by `then` (cheapest price, for the buy list)
+def rank_products(df: pd.DataFrame, positions: np.ndarray, k: Optional[int] = None, by: str = "Cup Price", then: str = "Price") -> Tuple[np.ndarray, int]:
+    ranked = positions[top_k(df[by].to_numpy(dtype=float)[positions], k)]
+    if len(ranked) == 0:
+        return ranked, -1
+    second = df[then].to_numpy(dtype=float)[ranked]
+    return ranked, int(np.argmin(np.where(np.isnan(second), np.inf, second)))
+
+
+# The rule set used for a product
+def product_rules(product: str, bad_list: Union[RuleSet, Sequence[str]] = RULE_SET) -> RuleSet:
+    # Hard code: leave an ingredient out of the bad list for this product only (ex: Syrup is bad but Maple Syrup isn't)
+    rules = as_rule_set(bad_list)
+    if "maple syrup" in product:
+        rules = rules.override(remove=["Syrup"])
+    return rules
+
+
+# Find all the good products of an item (ex: Item: Soba Noodles -> Products: "Obento Soba Noodles", "Redrock Soba Noodles", "Hakubaku Soba Noodles")
+# df has to be the catalog of category k, name_index its index (default: the index of k in the current snapshot)
+# top: only keep the top cheapest unit price products. The "Cheapest" column marks the one with the lowest price
+# bad_list: the RuleSet of the request (a list of rules works too)
+def find_product(product: str, df: pd.DataFrame, k: str, filter_ingredient = True, bad_list: Union[RuleSet, Sequence[str]] = RULE_SET, top: Optional[int] = None,
+                 name_index: Optional[NameIndex] = None) -> pd.DataFrame:
+    rules = product_rules(product, bad_list)
+    # Hard code: renaming/removing/replacing words from the product's name, singular/plural
+    product = normalize_ingredient(product)
+
+    # Split the product name into words to look up in the database (ex: Some brands say Noodles Soba instead of Soba Noodles)
+    product_split = product.split()
+
+    # Rows that contain the product name, from the name index of the category
+    positions = (name_index or get_name_index(k)).lookup(product_split)
+    # Every filter below only narrows a boolean mask over these rows; the result is built once at the end
+    keep = np.ones(len(positions), dtype=bool)
+
+    # Hard code
+    # Filter out rows with no ingredients for certain categories only
+    if k != 'fruit-veg' and k != 'poultry-meat-seafood':
+        keep &= ~pd.isna(df["Ingredients"].to_numpy()[positions])
+
+    # Select only rows that are within a department or similar criteria
+    if product == "honey":
+        keep &= _lower(df, "Aisle", positions) == "honey"
+    if product == "egg":
+        keep &= _lower(df, "Aisle", positions) == "eggs"
+    if product == "ginger":
+        keep &= _lower(df, "Department", positions) != "drink"
+    if product == "butter":
+        keep &= _lower(df, "Sap Category Name", positions) == "dairy - butter & margarine"
+    if "spaghetti" in product:
+        keep &= _lower(df, "Sap Sub Category Name", positions) == "pasta"
+    if any(word in product for word in ["parmesan", "cheddar", "mozzarella", "cheese"]):
+        keep &= _lower(df, "Department", positions) == "dairy"
+
+    print("Len of selected rows (before filtering): ", int(keep.sum()))
+
+    # Filter out the bad products with the verdicts precomputed in the catalog
+    if filter_ingredient:
+        keep[keep] &= clean_mask(df, rules, positions[keep])
+    positions = positions[keep]
+
+    # Cheapest unit price first
+    positions, cheapest = rank_products(df, positions, top)
+    columns = [df.columns.get_loc(column) for column in RESULT_COLUMNS]
+    clean_products_df_sorted = df.iloc[positions, columns].rename(columns=RESULT_COLUMNS).reset_index(drop=True)
+    clean_products_df_sorted["Cheapest"] = np.arange(len(positions)) == cheapest
+    if not clean_products_df_sorted.empty:
+        print("Clean product found")
+    return clean_products_df_sorted
+
+
+# The products found by find_product as json ready dicts (NaN -> None, numpy -> python types)
+def product_records(products: pd.DataFrame, top: Optional[int] = None) -> List[Dict[str, Any]]:
+    if top is not None:
+        products = products.head(top)
+    columns = []
+    for column in RECORD_KEYS:
+        values = products[column]
+        columns.append(values.astype(object).where(values.notna(), None).tolist())
+    records = []
+    for values in zip(*columns):
+        record = dict(zip(RECORD_KEYS.values(), values))
+        record["stockcode"] = PRODUCT_URL.format(record["stockcode"])
+        records.append(record)
+    return records
+
+
+# The record of the product to buy (lowest price) among the records of find_product's result
+def cheapest_record(products: pd.DataFrame, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    cheapest = products["Cheapest"].to_numpy()[:len(records)]
+    if cheapest.any():
+        return records[int(cheapest.argmax())]
+    # The records were cut before the cheapest one (find_product was called without top)
+    return min(records, key=lambda record: record["price"])
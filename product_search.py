@@ -0,0 +1,159 @@
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from catalog import CatalogSnapshot, current_snapshot
+from ingredient_filter import RULE_SET, RuleSet
+from normalizer import normalize_ingredient
+from product_finder import cheapest_record, find_product, product_records, product_rules
+from result_cache import ResultCache
+
+# Number of ingredients searched at the same time for one recipe (1 -> one after the other)
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", os.cpu_count() or 1))
+# "thread": workers share the loaded catalogs. "process": one process per core, each maps the catalogs
+SEARCH_EXECUTOR = os.getenv("SEARCH_EXECUTOR", "thread")
+# Skip unnecessary ingredients
+SKIP_INGREDIENTS = ["water", "sugar", "salt"]
+
+# Results of search_ingredient, shared by the requests of this process
+result_cache = ResultCache()
+# Set to 0 to search every ingredient again
+USE_RESULT_CACHE = os.getenv("USE_RESULT_CACHE", "1") == "1"
+
+# Pools are reused by every request, keyed by (executor, workers)
+_pools: Dict[Tuple[str, int], Executor] = {}
+_pools_lock = threading.Lock()
+# The pool threads don't survive fork (ex: a gunicorn worker): each process makes its own pools
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+def get_pool(executor: str = SEARCH_EXECUTOR, workers: int = SEARCH_WORKERS) -> Executor:
+    with _pools_lock:
+        if (executor, workers) not in _pools:
+            if executor == "process":
+                _pools[(executor, workers)] = ProcessPoolExecutor(max_workers=workers)
+            elif executor == "thread":
+                _pools[(executor, workers)] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search")
+            else:
+                raise ValueError(f"Unknown search executor: {executor}")
+        return _pools[(executor, workers)]
+
+
+def skip_ingredient(product: str) -> bool:
+    return any(item in product for item in SKIP_INGREDIENTS)
+
+
+# Search one ingredient of category k: (name it was found under, its top records, the record to buy)
+# Only plain python objects are returned so the result can come back from another process
+# snapshot: the catalogs of the request (default: the current ones of this process)
+def search_ingredient(product: str, k: str, bad_list: RuleSet = RULE_SET, top: Optional[int] = 5,
+                      filter_ingredient: bool = True, snapshot: Optional[CatalogSnapshot] = None) -> Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    print("Product: ", product)
+    print("Category: ", k)
+    snapshot = snapshot or current_snapshot()
+    # A request still running on the old catalogs after a reload doesn't use the cache: it would move it back
+    # to the old version, or fill it with entries nobody will read
+    if not USE_RESULT_CACHE or snapshot.version != current_snapshot().version:
+        return _search_ingredient(product, k, bad_list, top, filter_ingredient, snapshot)
+    # The same normalized ingredient gives the same products for a catalog version, rule set and top
+    # (the cached records are shared: don't modify them)
+    result_cache.check_version(snapshot.version)
+    key = (normalize_ingredient(product), k, product_rules(product, bad_list).hash, snapshot.version, top, filter_ingredient)
+    cached = result_cache.get(key)
+    if cached is not None:
+        name, records, cheapest = cached
+        return name or product, records, cheapest
+    name, records, cheapest = _search_ingredient(product, k, bad_list, top, filter_ingredient, snapshot)
+    # The name is only kept when it's an alternative name of the product
+    # Not kept if a reload invalidated the cache during the search
+    result_cache.set(key, (None if name == product else name, records, cheapest), version=snapshot.version)
+    return name, records, cheapest
+
+
+def _search_ingredient(product: str, k: str, bad_list: RuleSet, top: Optional[int], filter_ingredient: bool,
+                       snapshot: CatalogSnapshot) -> Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    # Load the preloaded catalog (pantry's 2 files are already merged)
+    df = snapshot.get_catalog(k)
+    name_index = snapshot.get_name_index(k)
+    clean_products_df_sorted = find_product(product, df, k, filter_ingredient=filter_ingredient, bad_list=bad_list, top=top, name_index=name_index)
+
+    # Find similar products (ex: Spring onion -> green onion) if not found
+    if clean_products_df_sorted.empty:
+        # Uncomment
+        # QUERIES_INPUT = f"""
+        #     Give me the other names of the the product in this prompt: {product}
+        #     If the prompt is a protein, then give me the protein name and the cut indicated. (e.g. boneless chicken thighs to chicken thighs)
+        #     ONLY if the names refer to one specific thing, otherwise don't.
+        #     Example: if the prompt is spring onion then similar products would be: green onions, scallions etc.
+        #     Format: ["alternative_name_1", "alternative_name_2",...]
+        # """
+        # similar_products = json_gpt(QUERIES_INPUT)
+        # print("Alternative names of the product: ", similar_products)
+        similar_products = []
+        for product in similar_products:
+            clean_products_df_sorted = find_product(product, df, k, filter_ingredient=filter_ingredient, bad_list=bad_list, top=top, name_index=name_index)
+            if not clean_products_df_sorted.empty:
+                break
+            print("Current alternative product: ", product)
+
+    if clean_products_df_sorted.empty:
+        return product, [], None
+    records = product_records(clean_products_df_sorted)
+    # The product to buy (lowest price) was picked in the same ranking pass
+    return product, records, cheapest_record(clean_products_df_sorted, records)
+
+
+def search_tasks(categorized_items: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    return [(product, k) for k, v in categorized_items.items() for product in v if not skip_ingredient(product)]
+
+
+# Search the (ingredient, category) tasks with a pool of `workers` and yield (task index, result) as each one finishes
+# Every task uses the catalog snapshot that is current when the search starts, even if a reload swaps in a new one
+# (process workers use their own current snapshot)
+def iter_search(tasks: List[Tuple[str, str]], top: Optional[int] = 5, bad_list: RuleSet = RULE_SET,
+                filter_ingredient: bool = True, workers: Optional[int] = None,
+                executor: Optional[str] = None) -> Iterator[Tuple[int, Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]]]]]:
+    workers = SEARCH_WORKERS if workers is None else workers
+    executor = SEARCH_EXECUTOR if executor is None else executor
+    snapshot = current_snapshot()
+    if workers <= 1 or len(tasks) <= 1:
+        for index, (product, k) in enumerate(tasks):
+            yield index, search_ingredient(product, k, bad_list, top, filter_ingredient, snapshot)
+        return
+    pool = get_pool(executor, workers)
+    if executor == "process":
+        snapshot = None
+    futures = {pool.submit(search_ingredient, product, k, bad_list, top, filter_ingredient, snapshot): index for index, (product, k) in enumerate(tasks)}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+# Merge the results in the order of the tasks -> all the good products, a grocery list, and the items that have no good products
+def merge_results(tasks: List[Tuple[str, str]], results: List[Tuple[str, List[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]], Dict[str, List[str]]]:
+    all_none = {}
+    all_res = {}
+    # The product to buy for each item
+    buy = {}
+    for (original_product, k), (product, records, cheapest) in zip(tasks, results):
+        if not records:
+            all_none[k] = all_none.get(k, []) + [original_product]
+            continue
+        all_res[product] = all_res.get(product, []) + records
+        if product not in buy or cheapest['price'] < buy[product]['price']:
+            buy[product] = cheapest
+    buy_list = list(buy.values())
+    return all_res, buy_list, all_none
+
+
+# Find the products of every categorized ingredient
+# The ingredients are searched in parallel; the results are merged in the order of categorized_items,
+# so the output is the same as searching them one after the other
+def search_products(categorized_items: Dict[str, List[str]], top: Optional[int] = 5, bad_list: RuleSet = RULE_SET,
+                    filter_ingredient: bool = True, workers: Optional[int] = None,
+                    executor: Optional[str] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]], Dict[str, List[str]]]:
+    tasks = search_tasks(categorized_items)
+    results = [None] * len(tasks)
+    for index, result in iter_search(tasks, top, bad_list, filter_ingredient, workers, executor):
+        results[index] = result
+    return merge_results(tasks, results)
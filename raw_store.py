@@ -0,0 +1,206 @@
+import argparse
+import ast
+import csv
+import gzip
+import json
+import os
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Compression level of the records (1: fastest, 9: smallest)
+RAW_COMPRESS_LEVEL = int(os.getenv("RAW_COMPRESS_LEVEL", 6))
+# The old raw files (str(dict) in a CSV) can have lines longer than the default csv field limit
+csv.field_size_limit(2 ** 31 - 1)
+
+
+# Raw product details: one JSON object per line ({"id": stockcode, "data": detail}), each line compressed as its own
+# gzip member. The file is a normal .jsonl.gz (gzip -dc reads it), and any record can be read alone:
+# its offset and length are in the index next to it (path + ".idx", one "stockcode,offset,length" line per record)
+# A product fetched again is appended: the last record of a stockcode is the current one
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def encode_record(stockcode: str, data: Dict) -> bytes:
+    line = json.dumps({"id": str(stockcode), "data": data}, ensure_ascii=False, separators=(",", ":")) + "\n"
+    return gzip.compress(line.encode(), compresslevel=RAW_COMPRESS_LEVEL, mtime=0)
+
+
+def decode_record(member: bytes) -> Tuple[str, Dict]:
+    record = json.loads(zlib.decompress(member, wbits=31))
+    return record["id"], record["data"]
+
+
+# Appends records to a raw file and its index
+class RawWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.data = open(path, "ab")
+        self.index = open(index_path(path), "a")
+
+    # Returns the size of the file once the record is in it
+    def append(self, stockcode: str, data: Dict, sync: bool = True) -> int:
+        member = encode_record(stockcode, data)
+        offset = self.data.tell()
+        self.data.write(member)
+        self.data.flush()
+        self.index.write(f"{stockcode},{offset},{len(member)}\n")
+        self.index.flush()
+        if sync:
+            os.fsync(self.data.fileno())
+            os.fsync(self.index.fileno())
+        return offset + len(member)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self) -> "RawWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# {stockcode: (offset, length)} of the current record of every product
+def read_index(path: str) -> Dict[str, Tuple[int, int]]:
+    index = {}
+    if not os.path.exists(index_path(path)):
+        return index
+    with open(index_path(path)) as f:
+        for line in f:
+            stockcode, offset, length = line.rstrip("\n").split(",")
+            index[stockcode] = (int(offset), int(length))
+    return index
+
+
+# The current detail of one product, without reading the rest of the file
+def read_record(path: str, stockcode: str, index: Optional[Dict[str, Tuple[int, int]]] = None) -> Optional[Dict]:
+    index = read_index(path) if index is None else index
+    if str(stockcode) not in index:
+        return None
+    offset, length = index[str(stockcode)]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return decode_record(f.read(length))[1]
+
+
+# Read some records with one open file: [(offset, length)] -> [(stockcode, detail)]
+def read_records(path: str, ranges: List[Tuple[int, int]]) -> List[Tuple[str, Dict]]:
+    records = []
+    with open(path, "rb") as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            records.append(decode_record(f.read(length)))
+    return records
+
+
+# (offset, length, line) of the complete gzip members of a file from `start`. Stops at a member cut in the middle
+# (or corrupted, ex: by a crash while it was written)
+def iter_members(path: str, start: int = 0, block_size: int = 1 << 20) -> Iterator[Tuple[int, int, bytes]]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        fed = 0
+        pending = b""
+        decompressor = zlib.decompressobj(wbits=31)
+        output = []
+        while True:
+            block = pending or f.read(block_size)
+            pending = b""
+            if not block:
+                return
+            try:
+                output.append(decompressor.decompress(block))
+            except zlib.error:
+                return
+            if not decompressor.eof:
+                fed += len(block)
+                continue
+            length = fed + len(block) - len(decompressor.unused_data)
+            yield offset, length, b"".join(output)
+            offset += length
+            fed = 0
+            pending = decompressor.unused_data
+            decompressor = zlib.decompressobj(wbits=31)
+            output = []
+
+
+# Match a raw file and its index to the size saved by the last checkpoint, after a crash:
+# complete records written after it are kept (and indexed), a record cut in the middle is removed
+# Returns the stockcodes of the records kept after `committed` and the new size of the file
+def recover(path: str, committed: int) -> Tuple[List[str], int]:
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < committed:
+        raise RuntimeError(f"{path} is smaller than its checkpoint")
+    recovered = []
+    end = committed
+    if size > committed:
+        for offset, length, line in iter_members(path, committed):
+            recovered.append((json.loads(line)["id"], offset, length))
+            end = offset + length
+        with open(path, "rb+") as f:
+            f.truncate(end)
+    # The index has exactly the records of the file
+    lines = []
+    if os.path.exists(index_path(path)):
+        with open(index_path(path)) as f:
+            lines = [line for line in f if line.endswith("\n") and sum(map(int, line.split(",")[1:])) <= committed]
+    lines += [f"{stockcode},{offset},{length}\n" for stockcode, offset, length in recovered]
+    tmp_path = f"{index_path(path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, index_path(path))
+    return [stockcode for stockcode, _, _ in recovered], end
+
+
+# Index of a raw file from its records (ex: the index was lost)
+def rebuild_index(path: str) -> int:
+    count = 0
+    tmp_path = f"{index_path(path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        for offset, length, line in iter_members(path):
+            f.write(f"{json.loads(line)['id']},{offset},{length}\n")
+            count += 1
+    os.replace(tmp_path, index_path(path))
+    return count
+
+
+# Convert a raw file of the Selenium scraper ([id, name, str(dict)] rows) into the JSON Lines format
+def convert_csv(csv_path: str, path: str) -> int:
+    count = 0
+    with open(csv_path, newline="", encoding="utf-8") as f, RawWriter(path) as writer:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                data = ast.literal_eval(row[2])
+            except (ValueError, SyntaxError) as e:
+                print("Invalid detail: ", row[0], e)
+                continue
+            writer.append(row[0], data, sync=False)
+            count += 1
+    return count
+
+
+# python raw_store.py get "Data/Woolies Item/Woolies pantry.jsonl.gz" 16436
+# python raw_store.py convert "Woolies 888 pantry.csv" "Data/Woolies Item/Woolies pantry.jsonl.gz"
+# python raw_store.py index "Data/Woolies Item/Woolies pantry.jsonl.gz"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw product details (compressed JSON Lines)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    get_parser = subparsers.add_parser("get", help="print the detail of a product")
+    get_parser.add_argument("path")
+    get_parser.add_argument("stockcode")
+    convert_parser = subparsers.add_parser("convert", help="append an old CSV raw file to a JSON Lines one")
+    convert_parser.add_argument("csv_path")
+    convert_parser.add_argument("path")
+    index_parser = subparsers.add_parser("index", help="rebuild the index of a raw file")
+    index_parser.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "get":
+        print(json.dumps(read_record(args.path, args.stockcode), indent=2, ensure_ascii=False))
+    elif args.command == "convert":
+        print(convert_csv(args.csv_path, args.path), " records")
+    else:
+        print(rebuild_index(args.path), " records")
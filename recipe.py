@@ -0,0 +1,340 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from category_classifier import USE_CLASSIFIER, CategoryClassifier
+from llm import CACHE_DIR, json_gpt
+from normalizer import singular
+from recipe_parser import PARSER_MIN_CONFIDENCE, parse_recipe
+
+# Give ChatGPT related subcategories of the general categories -> better chance of finding the right category
+CATEGORY_DICT = {
+    "bakery": ["bakery", "bread", "pastries"],
+    "dairy-eggs-fridge": ["dairy-eggs-fridge", "milk", "cheese", "yogurt", "cream", "dips", "ready meals", "international food", "vegan"],
+    "drinks": ["drinks", "juices", "soda", "water", "tea", "coffee", "energy drinks"],
+    "freezer": ["freezer", "frozen meals", "ice cream", "frozen vegetables", "frozen fruit"],
+    "fruit-veg": ["fruit-veg", "fruits", "vegetables", "salads", "organic", "fresh herbs"],
+    "health-wellness health-foods": ["health-wellness", "vitamins", "superfoods", "protein bars", "health-foods", "health foods", "dried fruit, nuts, seeds"],
+    "lunch-box": ["lunch-box", "sandwiches", "snack packs", "fruit cups"],
+    "pantry": ["pantry", "canned goods", "breakfast and spreads", "spices", "condiments", "pasta, rice, grains", "cooking sauces", "oil and vinegar", "international foods"],
+    "poultry-meat-seafood": ["poultry-meat-seafood", "poultry", "meat", "seafood"]
+}
+# Put them all into a list for ChatGPT and then re-categorize them later
+CATEGORY_LIST = [item for sublist in CATEGORY_DICT.values() for item in sublist]
+# Hard coding so ChatGPT doesn't have to process some ingredients -> Save money
+KNOWN_CATEGORY = {
+    "bakery": ["bakery", "bread", "pastries"],
+    "dairy-eggs-fridge": ["parmigiano reggiano", "milk", "cheese", "yogurt", "cream", "dips", "butter","egg"],
+    "drinks": ["drinks", "juices", "soda", "water", "tea", "coffee", "energy drinks"],
+    "freezer": ["freezer", "frozen meals", "ice cream", "frozen vegetables", "frozen fruit"],
+    "fruit-veg": ["scallion", "chopped onion", "white onion", "garlic cloves", "basil", "lime", "lemon","ginger", "chilli"],
+    "health-wellness health-foods": ["health-wellness", "vitamins", "superfoods", "protein bars", "health-foods", "health foods", "dried fruit, nuts, seeds"],
+    "lunch-box": [],
+    "pantry": ["fish sauce", "flour", "self-raising flour"],
+    "poultry-meat-seafood": ["poultry", "meat", "seafood"]
+}
+# Number of learned ingredients kept before the least recently used ones are removed
+CATEGORY_STORE_SIZE = int(os.getenv("CATEGORY_STORE_SIZE", 50000))
+# When a learned ingredient was last used is kept in memory and written in one transaction at most this often
+CATEGORY_STORE_FLUSH_SECONDS = float(os.getenv("CATEGORY_STORE_FLUSH_SECONDS", 60))
+# "separate": one ChatGPT call to extract the ingredients and one to categorize them. "combined": one call for both
+# (not the default until its answers are validated against the separate calls)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "separate")
+EXTRACTION_MODES = ["combined", "separate"]
+
+
+# General category of a ChatGPT subcategory (ex: "spices" -> "pantry")
+def general_category(subcategory: str) -> Optional[str]:
+    for category, keywords in CATEGORY_DICT.items():
+        if subcategory in keywords:
+            return category
+    return None
+
+
+# Ingredient -> general category learned from every ChatGPT categorization, so known ingredients skip ChatGPT
+# Kept in memory and in a SQLite file (the ingredients are singular and lower case)
+class CategoryStore:
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "categories.sqlite"), max_size: int = CATEGORY_STORE_SIZE,
+                 flush_seconds: float = CATEGORY_STORE_FLUSH_SECONDS):
+        self.path = path
+        self.max_size = max_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "learned": 0, "evictions": 0}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.reopen()
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                ingredient TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                seen INTEGER NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self.categories = dict(self.db.execute("SELECT ingredient, category FROM categories"))
+
+    # A SQLite connection can't be used across fork: each worker process opens its own
+    # (and reloads what the other workers learned since)
+    def reopen(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # {ingredient: last use} not written yet (the parent process writes its own)
+        self.used = {}
+        self.flushed = time.time()
+        if hasattr(self, "categories"):
+            self.categories = dict(self.db.execute("SELECT ingredient, category FROM categories"))
+
+    def get(self, ingredient: str) -> Optional[str]:
+        ingredient = singular(ingredient)
+        with self.lock:
+            category = self.categories.get(ingredient)
+            if category is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            # No write on every hit: the hits of the last flush_seconds are written together
+            now = time.time()
+            self.used[ingredient] = now
+            if now - self.flushed >= self.flush_seconds:
+                self._flush()
+            return category
+
+    def record(self, ingredient: str, category: str):
+        ingredient = singular(ingredient)
+        with self.lock:
+            if self.categories.get(ingredient) != category:
+                self.stats["learned"] += 1
+            self.categories[ingredient] = category
+            self.used.pop(ingredient, None)
+            self.db.execute("""
+                INSERT INTO categories VALUES (?, ?, 1, ?)
+                ON CONFLICT (ingredient) DO UPDATE SET category = excluded.category, seen = seen + 1, used = excluded.used
+            """, (ingredient, category, time.time()))
+            self._evict()
+
+    # Write the last uses kept in memory
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.used:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("UPDATE categories SET used = ? WHERE ingredient = ?",
+                                    [(used, ingredient) for ingredient, used in self.used.items()])
+            self.used = {}
+        self.flushed = time.time()
+
+    # Remove the least recently used ingredients when there are more than max_size
+    def _evict(self):
+        extra = len(self.categories) - self.max_size
+        if extra <= 0:
+            return
+        # The order of use has to be up to date
+        self._flush()
+        for (ingredient,) in self.db.execute("SELECT ingredient FROM categories ORDER BY used LIMIT ?", (extra,)).fetchall():
+            self.db.execute("DELETE FROM categories WHERE ingredient = ?", (ingredient,))
+            self.categories.pop(ingredient, None)
+            self.used.pop(ingredient, None)
+            self.stats["evictions"] += 1
+
+    # {ingredient: category} as a JSON file, to share what was learned or to seed another server
+    def export_json(self, path: str):
+        with self.lock:
+            categories = dict(sorted(self.categories.items()))
+        with open(path, "w") as f:
+            json.dump(categories, f, indent=2)
+
+    def import_json(self, path: str):
+        with open(path) as f:
+            categories = json.load(f)
+        for ingredient, category in categories.items():
+            if category in CATEGORY_DICT:
+                self.record(ingredient, category)
+
+
+category_store = CategoryStore()
+os.register_at_fork(after_in_child=category_store.reopen)
+atexit.register(category_store.flush)
+# Categories from the catalogs for the ingredients that aren't hard coded or learned yet
+classifier = CategoryClassifier(list(CATEGORY_DICT))
+
+
+# ChatGPT to get ingredients from recipes
+# Line per ingredient recipes are parsed locally, ChatGPT only gets the ones the parser isn't sure about
+def get_recipe_ingredients(recipe: str, use_parser: bool = True) -> List[str]:
+    if use_parser:
+        parsed = parsed_ingredients(recipe)
+        if parsed is not None:
+            return parsed
+
+    QUERIES_INPUT = f"""
+    Get all the ingredients in the recipe.
+    This is the recipe: {recipe}
+    Only include ingredients that are in the recipe, don't include the measurements.
+    Format: {{"Ingredients": ["ingredient_1", "ingredient_2",...]}}
+    """
+
+    similar_products = json_gpt(QUERIES_INPUT)["Ingredients"]
+    return similar_products
+
+
+# The ingredients found by the local parser, None when its confidence is too low
+def parsed_ingredients(recipe: str) -> Optional[List[str]]:
+    ingredients, confidence = parse_recipe(recipe)
+    print("Parser confidence: ", confidence)
+    if confidence < PARSER_MIN_CONFIDENCE:
+        return None
+    return ingredients
+
+
+# Category of an ingredient without ChatGPT: hard coded or learned from a previous answer
+def known_category(product: str) -> Optional[str]:
+    product2 = singular(product)
+    for k, v in KNOWN_CATEGORY.items():
+        if product2 in v:
+            return k
+    return category_store.get(product)
+
+
+# Add ChatGPT's {subcategory: items} to categorized_items under the general categories and remember the answer for next time
+# Returns the items of the subcategories that aren't in CATEGORY_LIST
+def merge_grouped(categorized_items: Dict[str, List[str]], grouped: Dict[str, List[str]]) -> List[str]:
+    invalid = []
+    for key, value in grouped.items():
+        category = general_category(key.strip().lower())
+        if category is None:
+            invalid += value
+            continue
+        for product in value:
+            category_store.record(product, category)
+        categorized_items[category] = categorized_items.get(category, []) + value
+    return invalid
+
+
+# ChatGPT to categorize data into their general categories that match the Woolies app
+# Only the ingredients that are neither hard coded, learned from a previous answer nor classified from the catalogs are sent to ChatGPT
+# The classifier's guesses are only used for this call: the category store only learns ChatGPT's answers
+def categorize_ingredients(ingredients: List[str], use_classifier: bool = USE_CLASSIFIER) -> Dict[str, List[str]]:
+    known_product = {}
+    unknown = []
+    for product in ingredients:
+        category = known_category(product)
+        if category is None and use_classifier:
+            category = classifier.classify(product)
+        if category is None:
+            unknown.append(product)
+        else:
+            known_product[category] = known_product.get(category, []) + [product]
+
+    categorized_items = known_product
+    if unknown:
+        # ChatGPT to help categorize items
+        QUERIES_INPUT = f"""
+        Group the items into their respective categories. Use ONLY the provided categories and items to create the desired grouping.
+
+        Categories: {CATEGORY_LIST}
+        Items: {unknown}
+
+        Skip empty lists.
+        Make sure to group all the items.
+
+        Format:
+        "category_1": ["item_1", "item_2", ...],
+        "category_2": ["item_1", "item_2", ...],
+        """
+
+        grouped = json_gpt(QUERIES_INPUT)
+        print("Output from GPT: ", grouped)
+        # Merge the subcategories into the general categories
+        merge_grouped(categorized_items, grouped)
+    # Filter out ones with empty list and remove duplicate
+    return {key: list(dict.fromkeys(value)) for key, value in categorized_items.items() if value}
+
+
+# ChatGPT's {subcategory: [items]} if it has that shape, None otherwise
+def _grouped_items(answer) -> Optional[Dict[str, List[str]]]:
+    if not isinstance(answer, dict) or not answer:
+        return None
+    for value in answer.values():
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            return None
+    return answer
+
+
+# One ChatGPT call to get the ingredients of the recipe already grouped into categories
+# The answer is checked: hard coded/learned categories win, items in unknown categories are categorized again,
+# and an answer that isn't {category: [items]} falls back to the 2 calls
+def extract_categorized_ingredients(recipe: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    QUERIES_INPUT = f"""
+    Get all the ingredients in the recipe and group them into their respective categories.
+    This is the recipe: {recipe}
+    Only include ingredients that are in the recipe, don't include the measurements.
+    Use ONLY these categories: {CATEGORY_LIST}
+    Skip empty lists.
+    Format: {{"category_1": ["ingredient_1", "ingredient_2", ...], "category_2": ["ingredient_3", ...]}}
+    """
+
+    try:
+        grouped = _grouped_items(json_gpt(QUERIES_INPUT))
+    except (ValueError, TimeoutError) as e:
+        print("Combined extraction failed: ", e)
+        grouped = None
+    if grouped is None:
+        return extract_then_categorize(recipe)
+    print("Output from GPT: ", grouped)
+
+    ingredients = list(dict.fromkeys(item for value in grouped.values() for item in value))
+    categorized_items = {}
+    unsure = {}
+    for key, value in grouped.items():
+        for product in value:
+            category = known_category(product)
+            if category is None:
+                unsure[key] = unsure.get(key, []) + [product]
+            else:
+                categorized_items[category] = categorized_items.get(category, []) + [product]
+    invalid = merge_grouped(categorized_items, unsure)
+    if invalid:
+        print("Items in unknown categories: ", invalid)
+        for category, value in categorize_ingredients(invalid).items():
+            categorized_items[category] = categorized_items.get(category, []) + value
+    return ingredients, {key: list(dict.fromkeys(value)) for key, value in categorized_items.items() if value}
+
+
+# The 2 calls: ingredients of the recipe, then their categories
+def extract_then_categorize(recipe: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    ingredients = get_recipe_ingredients(recipe, use_parser=False)
+    return ingredients, categorize_ingredients(ingredients)
+
+
+# Ingredients of the recipe and their general categories, with 1 (combined) or 2 (separate) ChatGPT calls
+# A recipe the local parser is sure about only needs ChatGPT for the ingredients it can't categorize
+def get_categorized_ingredients(recipe: str, mode: Optional[str] = None, use_parser: bool = True) -> Tuple[List[str], Dict[str, List[str]]]:
+    mode = mode or EXTRACTION_MODE
+    if use_parser and mode in EXTRACTION_MODES:
+        parsed = parsed_ingredients(recipe)
+        if parsed is not None:
+            return parsed, categorize_ingredients(parsed)
+    if mode == "combined":
+        return extract_categorized_ingredients(recipe)
+    if mode == "separate":
+        return extract_then_categorize(recipe)
+    raise ValueError(f"Unknown extraction mode: {mode}")
+
+
+# Share what was learned: python recipe.py export categories.json / python recipe.py import categories.json
+if __name__ == "__main__":
+    import sys
+
+    command, path = sys.argv[1], sys.argv[2]
+    if command == "export":
+        category_store.export_json(path)
+    elif command == "import":
+        category_store.import_json(path)
+    print(len(category_store.categories), "ingredients")
@@ -0,0 +1,98 @@
+import os
+import re
+from typing import List, Tuple
+
+from normalizer import WORDS_TO_REMOVE
+
+# Recipes parsed with at least this confidence don't go to ChatGPT
+PARSER_MIN_CONFIDENCE = float(os.getenv("PARSER_MIN_CONFIDENCE", 0.8))
+
+# Quantities: 2, 1.5, 1/2, 1 1/2, ½, 2-3, 200g (the unit is matched separately)
+QUANTITY = re.compile(r"^(?:about\s+|approx\.?\s+)?(?:\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?|[¼½¾⅓⅔⅛])(?:\s*(?:-|to)\s*\d+(?:[.,]\d+)?)?\s*", re.IGNORECASE)
+UNITS = [
+    "tablespoons", "tablespoon", "tbsp", "tbs", "tb", "teaspoons", "teaspoon", "tsp", "cups", "cup",
+    "grams", "gram", "g", "kilograms", "kilogram", "kg", "millilitres", "milliliters", "ml", "litres", "liters", "l",
+    "ounces", "ounce", "oz", "pounds", "pound", "lbs", "lb", "pinches", "pinch", "dashes", "dash", "handfuls", "handful",
+    "cans", "can", "tins", "tin", "packets", "packet", "bunches", "bunch", "sprigs", "sprig", "stalks", "stalk",
+    "cloves", "clove", "pieces", "piece", "slices", "slice", "sheets", "sheet",
+]
+UNIT = re.compile(r"^(?:" + "|".join(UNITS) + r")\b\.?\s*(?:of\s+)?", re.IGNORECASE)
+# Preparation words on top of the words the normalizer removes (ex: "2 eggs lightly beaten")
+PREPARATION_WORDS = tuple(sorted(set(WORDS_TO_REMOVE) | {
+    "beaten", "lightly", "finely", "roughly", "thinly", "minced", "peeled", "deseeded", "trimmed", "halved", "quartered",
+    "softened", "melted", "rinsed", "drained", "fresh", "large", "small", "medium", "optional", "cut", "torn",
+}))
+PREPARATION = re.compile(r"\b(?:" + "|".join(map(re.escape, PREPARATION_WORDS)) + r")\b", re.IGNORECASE)
+# The rest of the line is about the preparation (ex: ", chopped", " to taste", " (optional)")
+TRAILING = re.compile(r"\s*(?:[,(;]|\s-\s|\bto taste\b|\bfor (?:serving|garnish)\b|\binto\b).*$", re.IGNORECASE)
+# Lines without a quantity that are still ingredients (ex: "Salt and pepper to taste")
+UNMEASURED = re.compile(r"\b(?:to taste|for (?:serving|garnish)|optional)\b", re.IGNORECASE)
+# Lines that are steps of the method, not ingredients
+INSTRUCTION = re.compile(r"^(?:preheat|heat|bake|stir|mix|cook|add|serve|place|combine|whisk|bring|pour|fry|season|remove|cover|simmer|step)\b", re.IGNORECASE)
+# "plain/all-purpose flour" -> "plain flour"
+ALTERNATIVE = re.compile(r"(\w+)/[\w-]+")
+# "1 x 400g tin" -> the quantity, unit and "x" can repeat
+TIMES = re.compile(r"^x\s+", re.IGNORECASE)
+# The ingredients stop at the method
+METHOD_HEADER = re.compile(r"^(?:method|instructions|directions|steps|preparation)\s*:?$", re.IGNORECASE)
+
+
+# One line of the recipe -> (ingredients, confidence of the line)
+def parse_line(line: str) -> Tuple[List[str], float]:
+    line = line.strip().lstrip("-*•").strip()
+    if not line or line.endswith(":"):
+        return [], 1.0
+    if INSTRUCTION.match(line):
+        return [], 0.0
+    confidence = 1.0
+    measured = False
+    while True:
+        match = QUANTITY.match(line) or UNIT.match(line) or TIMES.match(line)
+        if not match or not match.end():
+            break
+        line = line[match.end():]
+        measured = True
+    # No quantity nor unit: could be an ingredient ("salt") or a sentence
+    if not measured and not UNMEASURED.search(line):
+        confidence -= 0.3
+
+    line = TRAILING.sub("", line)
+    line = ALTERNATIVE.sub(r"\1", line)
+    words = [word.lower() for word in PREPARATION.sub(" ", line).split() if word.isalpha() or "-" in word]
+    if not words:
+        return [], 0.0
+    # Ingredient names are short
+    if len(words) > 4:
+        confidence -= 0.2 * (len(words) - 4)
+    # "4 cups chicken stock or water" -> the first alternative is the one to buy
+    if "or" in words[1:]:
+        words = words[:words.index("or", 1)]
+    # "Salt and pepper" -> 2 ingredients. With a quantity it could be one ("2 cups fruit and nut mix")
+    # or two ("1 tsp salt and pepper"): ChatGPT decides
+    if measured and "and" in words:
+        confidence -= 0.3
+    if not measured and "and" in words:
+        names = " ".join(words).lower().split(" and ")
+    else:
+        names = [" ".join(words).lower()]
+    return [name for name in names if name], max(confidence, 0.0)
+
+
+# Ingredients of a line per ingredient recipe, without ChatGPT
+# The confidence (0 to 1) is the lowest of the lines: one line that doesn't look like an ingredient is enough to ask ChatGPT
+def parse_recipe(recipe: str) -> Tuple[List[str], float]:
+    ingredients = []
+    confidence = 1.0
+    lines = [line for line in recipe.splitlines() if line.strip()]
+    # A single line is a dish name or a sentence more often than an ingredient list
+    if len(lines) < 2:
+        confidence = 0.5
+    for line in lines:
+        if METHOD_HEADER.match(line.strip()):
+            break
+        names, line_confidence = parse_line(line)
+        confidence = min(confidence, line_confidence)
+        ingredients += names
+    if not ingredients:
+        confidence = 0.0
+    return list(dict.fromkeys(ingredients)), confidence
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# Size of the cache of search results before the least recently used ones are removed
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 20000))
+
+
+# In-memory LRU of search results, limited in entries and in bytes (size of the results as JSON)
+# The keys contain the catalog version; when a new snapshot is served the old results are dropped at once
+class ResultCache:
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_size: int = RESULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.version = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    # Drop everything computed on another catalog version
+    def check_version(self, version: str):
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.stats["invalidations"] += 1
+                self.entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    # version: the catalog version the value was computed on. It isn't kept if the cache moved to another one
+    # (ex: a request still running on the old catalogs after a reload)
+    def set(self, key: Hashable, value: Any, version: Optional[str] = None):
+        size = len(json.dumps(value, default=str))
+        # Bigger than the whole cache: not worth keeping
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[0]
+            self.entries[key] = (size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self.entries) > self.max_size:
+                self.bytes -= self.entries.popitem(last=False)[1][0]
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def info(self) -> dict:
+        return {**self.stats, "entries": len(self.entries), "bytes": self.bytes, "version": self.version}
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from product_fetcher import FAILED, FETCH_CONCURRENCY, FETCH_RATE, FETCHED, NOT_FOUND, RECORDED_DIR, ProductFetcher, category_ids
+from raw_store import RawWriter, convert_csv, index_path, read_index, recover as recover_records
+
+# Setup
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ITEM_DIR = os.path.join(BASE_DIR, "Data", "Woolies Item")
+# Progress of every scrape job: which IDs are done, missing or failed
+CHECKPOINT_PATH = os.path.join(ITEM_DIR, "scrape_jobs.sqlite")
+# A failed ID is tried again by the next runs until it failed this many times
+MAX_ATTEMPTS = int(os.getenv("SCRAPE_MAX_ATTEMPTS", 5))
+PENDING = "pending"
+
+
+# Raw details of a category, in the format of raw_store.py
+def item_path(category: str) -> str:
+    return os.path.join(ITEM_DIR, f"Woolies {category}.jsonl.gz")
+
+
+# Scrape of the details of one category, that can stop at any point and resume where it stopped
+# The state of every ID is checkpointed in SQLite, and the details are appended to one raw file:
+# an ID is only marked done once its record is in the file, and the file size is saved in the same transaction
+# A restart skips the IDs that are done or missing and only fetches the pending ones and the failed ones again
+class ScrapeJob:
+    def __init__(self, category: str, output: Optional[str] = None, checkpoint_path: str = CHECKPOINT_PATH):
+        self.category = category
+        self.output = output or item_path(category)
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self.output), exist_ok=True)
+        self.db = sqlite3.connect(checkpoint_path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                name TEXT PRIMARY KEY,
+                output TEXT NOT NULL,
+                committed INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                job TEXT NOT NULL,
+                stockcode TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (job, stockcode)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS items_status ON items (job, status)")
+        now = time.time()
+        self.db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, 0, ?, ?)", (category, self.output, now, now))
+        output, self.committed = self.db.execute("SELECT output, committed FROM jobs WHERE name = ?", (category,)).fetchone()
+        if output != self.output:
+            self.migrate(output)
+
+    # The job was writing another file (ex: the CSV of the first scrape jobs): its records are moved to the new one
+    # The IDs marked done whose record isn't in the new file (ex: the old file was lost, or isn't a CSV) are
+    # fetched again instead of being skipped forever
+    def migrate(self, output: str):
+        committed = 0
+        if os.path.exists(output) and output.endswith(".csv") and not os.path.exists(self.output):
+            print(self.category, ": converting ", output, " to ", self.output)
+            convert_csv(output, self.output)
+            committed = os.path.getsize(self.output)
+        elif os.path.exists(self.output):
+            # The records already in the file are kept: the job goes on after them
+            committed = os.path.getsize(self.output)
+        self.db.execute("UPDATE jobs SET output = ?, committed = ?, updated = ? WHERE name = ?",
+                        (self.output, committed, time.time(), self.category))
+        self.committed = committed
+        # The index matches the file before the done IDs are compared to it
+        self.recover()
+        index = read_index(self.output)
+        done = self.db.execute("SELECT stockcode FROM items WHERE job = ? AND status = ?", (self.category, FETCHED))
+        missing = [stockcode for stockcode, in done if stockcode not in index]
+        if missing:
+            print(self.category, ": ", len(missing), " done IDs are not in ", self.output, ", fetching them again")
+            self.requeue(missing)
+
+    def add_ids(self, stockcodes: List[str]):
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR IGNORE INTO items (job, stockcode, status, updated) VALUES (?, ?, ?, ?)",
+                                [(self.category, str(stockcode), PENDING, now) for stockcode in stockcodes])
+
+    # Fetch some IDs again at the next run (ex: their listing changed). The new rows are appended after
+    # the old ones: readers keep the last row of an ID
+    def requeue(self, stockcodes: List[str]):
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE items SET status = ?, attempts = 0, updated = ? WHERE job = ? AND stockcode = ?",
+                                [(PENDING, now, self.category, str(stockcode)) for stockcode in stockcodes])
+
+    # When the detail of each ID was last fetched (IDs that are done, or missing from the API)
+    def fetched_at(self) -> Dict[str, float]:
+        rows = self.db.execute("SELECT stockcode, updated FROM items WHERE job = ? AND status IN (?, ?)",
+                               (self.category, FETCHED, NOT_FOUND))
+        return dict(rows.fetchall())
+
+    # Match the output file to the checkpoint after a crash: records written after the last saved size are complete
+    # details, so they are marked done instead of fetched again. A record cut in the middle is removed
+    def recover(self):
+        try:
+            stockcodes, committed = recover_records(self.output, self.committed)
+        except RuntimeError as e:
+            raise RuntimeError(f"{e}: restart the job with --restart")
+        if stockcodes:
+            print(self.category, ": recovered ", len(stockcodes), " records written after the last checkpoint")
+        self.commit([(stockcode, FETCHED) for stockcode in stockcodes], committed)
+
+    # Save the outcome of some IDs and the size of the output file that has their rows, in one transaction
+    def commit(self, outcomes: List[tuple], committed: int):
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE items SET status = ?, attempts = attempts + 1, updated = ? WHERE job = ? AND stockcode = ?",
+                                [(status, now, self.category, stockcode) for stockcode, status in outcomes])
+            self.db.execute("UPDATE jobs SET committed = ?, updated = ? WHERE name = ?", (committed, now, self.category))
+        self.committed = committed
+
+    # IDs still to fetch: the pending ones, and the failed ones that haven't used up their attempts
+    def todo(self, retry_failed: bool = True, max_attempts: int = MAX_ATTEMPTS) -> List[str]:
+        statuses = [PENDING, FAILED] if retry_failed else [PENDING]
+        rows = self.db.execute(
+            f"SELECT stockcode FROM items WHERE job = ? AND status IN ({', '.join('?' * len(statuses))}) AND attempts < ? ORDER BY rowid",
+            (self.category, *statuses, max_attempts))
+        return [stockcode for stockcode, in rows]
+
+    def progress(self) -> Dict[str, int]:
+        rows = self.db.execute("SELECT status, COUNT(*) FROM items WHERE job = ? GROUP BY status", (self.category,))
+        return dict(rows.fetchall())
+
+    # Forget the progress and the output of the job
+    def reset(self):
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute("DELETE FROM items WHERE job = ?", (self.category,))
+            self.db.execute("UPDATE jobs SET committed = 0, updated = ? WHERE name = ?", (time.time(), self.category))
+        self.committed = 0
+        for path in [self.output, index_path(self.output)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def run(self, stockcodes: Optional[List[str]] = None, retry_failed: bool = True, **fetcher_args) -> Dict[str, int]:
+        self.recover()
+        self.add_ids(category_ids(self.category) if stockcodes is None else stockcodes)
+        todo = self.todo(retry_failed)
+        print(self.category, ": ", len(todo), " IDs to fetch, ", self.progress())
+        start = time.perf_counter()
+        async with ProductFetcher(**fetcher_args) as fetcher:
+            with RawWriter(self.output) as writer:
+                async for count, (stockcode, status, data) in _enumerate(fetcher.iter_fetch(todo), 1):
+                    if status == FETCHED and not (data and data.get("Product")):
+                        status = NOT_FOUND
+                    committed = writer.append(stockcode, data) if status == FETCHED else self.committed
+                    self.commit([(stockcode, status)], committed)
+                    if count % 100 == 0:
+                        print(self.category, ": ", count, "/", len(todo))
+        progress = self.progress()
+        print(self.category, ": ", progress, " ", fetcher.stats, " in ", round(time.perf_counter() - start, 1), "s")
+        return progress
+
+    def close(self):
+        self.db.close()
+
+
+async def _enumerate(items, start: int = 0):
+    index = start
+    async for item in items:
+        yield index, item
+        index += 1
+
+
+# Scrape (or resume) the details of some categories, one after the other
+async def run_jobs(categories: List[str], limit: Optional[int] = None, retry_failed: bool = True, restart: bool = False,
+                   **fetcher_args) -> Dict[str, Dict[str, int]]:
+    results = {}
+    for category in categories:
+        job = ScrapeJob(category)
+        try:
+            if restart:
+                job.reset()
+            ids = category_ids(category)[:limit] if limit else None
+            results[category] = await job.run(ids, retry_failed, **fetcher_args)
+        finally:
+            job.close()
+    return results
+
+
+# python scrape_jobs.py pantry bakery          (run again after a crash or Ctrl+C to resume)
+# python scrape_jobs.py pantry --status        (progress only)
+# WOOLIES_BASE_URL=http://127.0.0.1:8002 python scrape_jobs.py bakery  (against woolies_stub.py)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable scrape of the Woolies product details")
+    parser.add_argument("categories", nargs="+", help="categories of Data/Woolies ID (ex: pantry)")
+    parser.add_argument("--limit", type=int, help="only the first IDs of each category")
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=FETCH_RATE, help="requests per second (0: no limit)")
+    parser.add_argument("--no-retry", action="store_true", help="don't fetch the failed IDs again")
+    parser.add_argument("--restart", action="store_true", help="forget the progress and start from scratch")
+    parser.add_argument("--status", action="store_true", help="print the progress of the jobs and exit")
+    parser.add_argument("--record", action="store_true", help=f"also save the raw responses in {RECORDED_DIR}")
+    args = parser.parse_args()
+    if args.status:
+        for category in args.categories:
+            job = ScrapeJob(category)
+            print(category, ": ", job.progress(), ", output ", job.output, " (", job.committed, " bytes)")
+            job.close()
+    else:
+        asyncio.run(run_jobs(args.categories, args.limit, not args.no_retry, args.restart, concurrency=args.concurrency,
+                             rate=args.rate, record_dir=RECORDED_DIR if args.record else None))
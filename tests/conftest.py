@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+# The modules are at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Serve an aiohttp app on an ephemeral port from its own event loop thread, like the stub servers run next to the code
+class AppServer:
+    def __init__(self, app: web.Application):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="stub", daemon=True)
+        self.thread.start()
+        self.runner = web.AppRunner(app)
+        self.port = self.run(self._start())
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _start(self) -> int:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self.run(self.runner.cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(app: web.Application) -> AppServer:
+        server = AppServer(app)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,71 @@
+import os
+
+import pyarrow as pa
+import pytest
+
+from extract_items import extract_category
+from raw_store import RawWriter, index_path
+
+
+def detail(stockcode: int) -> dict:
+    return {"Product": {"Stockcode": stockcode, "Name": f"Product {stockcode}", "Price": 1.5},
+            "AdditionalAttributes": {"ingredients": "Flour, Water"}}
+
+
+def write_raw(path: str, details: dict):
+    with RawWriter(path) as writer:
+        for stockcode, data in details.items():
+            writer.append(str(stockcode), data, sync=False)
+
+
+def read_rows(path: str) -> list:
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().column("Stockcode").to_pylist()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_extract(tmp_path, workers):
+    source, target = str(tmp_path / "raw.jsonl.gz"), str(tmp_path / "out.arrow")
+    write_raw(source, {1: detail(1), 2: detail(2), 3: detail(3)})
+    stats = extract_category("bakery", source, target, workers=workers, chunk_rows=2)
+    assert stats == {"rows": 3, "errors": 0, "chunks": 2}
+    assert read_rows(target) == [1, 2, 3]
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    source, target = str(tmp_path / "raw.jsonl.gz"), str(tmp_path / "out.arrow")
+    write_raw(source, {1: detail(1), 2: detail(2), 3: detail(3)})
+    with open(index_path(source)) as f:
+        _, offset, length = f.readlines()[1].split(",")
+    with open(source, "rb+") as f:
+        f.seek(int(offset) + 12)
+        f.write(b"\xff" * 8)
+    stats = extract_category("bakery", source, target, workers=1)
+    assert stats["rows"] == 2 and stats["errors"] == 1
+
+
+def test_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        extract_category("bakery", str(tmp_path / "raw.jsonl.gz"), str(tmp_path / "out.arrow"), workers=1)
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    source, target = str(tmp_path / "raw.jsonl.gz"), str(tmp_path / "out.arrow")
+    write_raw(source, {1: detail(1), 2: detail(2)})
+    os.remove(index_path(source))
+    assert extract_category("bakery", source, target, workers=1)["rows"] == 2
+    assert read_rows(target) == [1, 2]
+
+
+def test_empty_result_keeps_the_target(tmp_path):
+    source, target = str(tmp_path / "raw.jsonl.gz"), str(tmp_path / "out.arrow")
+    write_raw(source, {1: detail(1)})
+    extract_category("bakery", source, target, workers=1)
+    # Only details without a product: nothing to serve
+    empty = str(tmp_path / "empty.jsonl.gz")
+    write_raw(empty, {2: {"Product": None}})
+    with pytest.raises(ValueError):
+        extract_category("bakery", empty, target, workers=1)
+    assert read_rows(target) == [1]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
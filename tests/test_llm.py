@@ -0,0 +1,120 @@
+import asyncio
+
+import openai
+import pytest
+
+import llm
+import recipe
+from llm import AsyncLLMClient, LLMCache
+from llm_stub import StubServer
+from recipe import CategoryStore
+
+PROMPT = """
+    Group the items into their respective categories. Use ONLY the provided categories and items to create the desired grouping.
+    Items: ['flour', 'sugar']
+"""
+
+
+# The first request is slow, the next ones answer at once
+class SlowFirstStub(StubServer):
+    def request_delay(self, count: int) -> float:
+        return self.slow_delay if count == 1 else self.delay
+
+
+def make_stub(**options) -> StubServer:
+    settings = {"delay": 0.0, "jitter": 0.0, "slow_rate": 0.0, "slow_delay": 1.0, "error_rate": 0.0, **options}
+    return StubServer(**settings)
+
+
+@pytest.fixture
+def stub_api(monkeypatch, tmp_path, serve):
+    # Every test has its own response cache, and the API calls go to the stub
+    monkeypatch.setattr(llm, "cache", LLMCache(str(tmp_path / "llm.sqlite")))
+    monkeypatch.setattr(openai, "api_key", "stub")
+    clients = []
+
+    def start(stub: StubServer, **options) -> AsyncLLMClient:
+        server = serve(stub.app())
+        monkeypatch.setattr(openai, "api_base", server.url + "/v1")
+        client = AsyncLLMClient(**{"hedge_percentile": 0, **options})
+        clients.append(client)
+        return client
+
+    yield start
+    for client in clients:
+        if client.session is not None:
+            client.run(client.session.close())
+        if client.loop is not None:
+            client.loop.call_soon_threadsafe(client.loop.stop)
+
+
+async def _gather(client: AsyncLLMClient, count: int, **options):
+    return await asyncio.gather(*[client.json_gpt(PROMPT, **options) for _ in range(count)])
+
+
+def test_answer(stub_api):
+    stub = make_stub()
+    client = stub_api(stub)
+    assert client.run(client.json_gpt(PROMPT)) == {"pantry": ["flour", "sugar"]}
+    # The second time comes from the cache
+    assert client.run(client.json_gpt(PROMPT)) == {"pantry": ["flour", "sugar"]}
+    assert stub.stats["requests"] == 1
+
+
+def test_identical_prompts_share_one_request(stub_api):
+    stub = make_stub(delay=0.2)
+    client = stub_api(stub)
+    answers = client.run(_gather(client, 10, use_cache=False))
+    assert answers == [{"pantry": ["flour", "sugar"]}] * 10
+    assert stub.stats["requests"] == 1
+    assert client.stats["requests"] == 1
+    assert client.stats["coalesced"] == 9
+
+
+def test_timeout(stub_api):
+    stub = make_stub(delay=1.0)
+    client = stub_api(stub)
+    with pytest.raises(TimeoutError):
+        client.run(client.json_gpt(PROMPT, timeout=0.1))
+    assert client.stats["timeouts"] == 1
+
+
+@pytest.mark.parametrize("options, error", [({"error_rate": 1.0}, openai.error.APIError),
+                                            ({"throttle_rate": 1.0}, openai.error.RateLimitError)])
+def test_retry(stub_api, options, error):
+    stub = make_stub(**options)
+    client = stub_api(stub, retries=2)
+    with pytest.raises(error):
+        client.run(client.json_gpt(PROMPT))
+    assert stub.stats["requests"] == 3
+    assert client.stats["retries"] == 2
+    assert client.stats["errors"] == 1
+
+
+def test_hedge_wins_over_slow_request(stub_api):
+    stub = SlowFirstStub(delay=0.0, jitter=0.0, slow_rate=0.0, slow_delay=2.0, error_rate=0.0)
+    client = stub_api(stub, hedge_percentile=95, hedge_min_samples=5)
+    client.latencies.extend([0.05] * 10)
+    assert client.run(client.json_gpt(PROMPT)) == {"pantry": ["flour", "sugar"]}
+    assert stub.stats["requests"] == 2
+    assert client.stats["hedges"] == 1
+    assert client.stats["hedge_wins"] == 1
+
+
+def test_no_hedge_without_latencies(stub_api):
+    stub = make_stub(delay=0.2)
+    client = stub_api(stub, hedge_percentile=95, hedge_min_samples=5)
+    client.run(client.json_gpt(PROMPT))
+    assert stub.stats["requests"] == 1
+    assert client.stats["hedges"] == 0
+
+
+@pytest.mark.parametrize("mode", ["combined", "separate"])
+def test_extraction_modes(stub_api, monkeypatch, tmp_path, mode):
+    stub = make_stub()
+    monkeypatch.setattr(llm, "client", stub_api(stub))
+    monkeypatch.setattr(recipe, "category_store", CategoryStore(str(tmp_path / "categories.sqlite")))
+    ingredients, categorized_items = recipe.get_categorized_ingredients("2 cups flour\n1 tsp cumin", mode, use_parser=False)
+    assert ingredients == ["flour", "cumin"]
+    assert categorized_items == {"pantry": ["flour", "cumin"]}
+    assert stub.stats["requests"] == (1 if mode == "combined" else 2)
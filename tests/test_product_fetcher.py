@@ -0,0 +1,152 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+import delta_scrape
+import product_fetcher
+from product_fetcher import FAILED, FETCHED, NOT_FOUND, ProductFetcher, TokenBucket, category_ids, listing_files
+from raw_store import read_index, read_record
+from scrape_jobs import ScrapeJob
+from woolies_stub import WooliesStub
+
+IDS = [str(stockcode) for stockcode in range(1001, 1013)]
+
+
+@pytest.fixture
+def recorded_dir(tmp_path):
+    folder = tmp_path / "recorded"
+    folder.mkdir()
+    for stockcode in IDS:
+        detail = {"Product": {"Stockcode": int(stockcode), "Name": f"Product {stockcode}"}}
+        (folder / f"{stockcode}.json").write_text(json.dumps(detail))
+    return str(folder)
+
+
+@pytest.fixture
+def woolies(serve, recorded_dir):
+    def start(**options):
+        stub = WooliesStub(recorded_dir, **{"delay": 0.01, "jitter": 0.0, **options})
+        return stub, serve(stub.app()).url
+    return start
+
+
+async def _fetch_all(stockcodes, **fetcher_args):
+    async with ProductFetcher(**fetcher_args) as fetcher:
+        results = {stockcode: (status, data) async for stockcode, status, data in fetcher.iter_fetch(stockcodes)}
+    return results, fetcher.stats
+
+
+def test_token_bucket_rate():
+    async def acquire(count):
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 2 tokens at once, then one every 50ms
+    assert asyncio.run(acquire(2)) < 0.04
+    assert asyncio.run(acquire(6)) >= 0.19
+
+
+def test_fetch(woolies):
+    stub, url = woolies(delay=0.05)
+    results, stats = asyncio.run(_fetch_all(IDS + ["404"], base_url=url, concurrency=3, rate=0))
+    assert {stockcode: status for stockcode, (status, _) in results.items()} == {**{stockcode: FETCHED for stockcode in IDS}, "404": NOT_FOUND}
+    assert results["1001"][1]["Product"]["Name"] == "Product 1001"
+    assert stats["fetched"] == len(IDS) and stats["not_found"] == 1
+    assert stub.stats["max_in_flight"] <= 3
+
+
+def test_rate_limit_is_respected(woolies):
+    stub, url = woolies(rate_limit=8)
+    start = time.monotonic()
+    results, stats = asyncio.run(_fetch_all(IDS, base_url=url, concurrency=8, rate=5, burst=3))
+    # 3 at once, then 5 per second: the stub never has to throttle
+    assert time.monotonic() - start >= (len(IDS) - 3) / 5 - 0.1
+    assert all(status == FETCHED for status, _ in results.values())
+    assert stub.stats["throttled"] == 0 and stats["throttled"] == 0
+
+
+def test_throttled_requests_are_retried(woolies):
+    stub, url = woolies(rate_limit=5)
+    results, stats = asyncio.run(_fetch_all(IDS, base_url=url, concurrency=8, rate=0, retries=5, backoff=0))
+    assert all(status == FETCHED for status, _ in results.values())
+    assert stub.stats["throttled"] > 0
+    assert stats["throttled"] == stub.stats["throttled"]
+
+
+def test_errors_are_retried_then_failed(woolies):
+    stub, url = woolies(error_rate=1.0)
+    results, stats = asyncio.run(_fetch_all(IDS[:3], base_url=url, rate=0, retries=2, backoff=0))
+    assert all(status == FAILED and data is None for status, data in results.values())
+    assert stub.stats["requests"] == 3 * 3
+    assert stats["retries"] == 3 * 2 and stats["errors"] == 3
+
+
+def test_resume_after_crash(woolies, tmp_path):
+    stub, url = woolies()
+    output = str(tmp_path / "Woolies bakery.jsonl.gz")
+    checkpoint = str(tmp_path / "scrape_jobs.sqlite")
+    # One at a time: the records are in the order of IDS
+    fetcher_args = {"base_url": url, "concurrency": 1, "rate": 0, "backoff": 0}
+
+    job = ScrapeJob("bakery", output, checkpoint)
+    assert asyncio.run(job.run(IDS, **fetcher_args)) == {FETCHED: len(IDS)}
+    index = read_index(output)
+    # Crash after the first 4 checkpoints: 5 to 11 were written and the last record is cut in the middle
+    offset, length = index[IDS[-1]]
+    with open(output, "rb+") as f:
+        f.truncate(offset + length // 2)
+    job.db.execute("UPDATE jobs SET committed = ?", (index[IDS[4]][0],))
+    job.db.execute("UPDATE items SET status = 'pending', attempts = 0 WHERE stockcode >= ?", (IDS[4],))
+    job.close()
+
+    requests = stub.stats["requests"]
+    job = ScrapeJob("bakery", output, checkpoint)
+    assert asyncio.run(job.run(IDS, **fetcher_args)) == {FETCHED: len(IDS)}
+    job.close()
+    # Only the cut record is fetched again
+    assert stub.stats["requests"] - requests == 1
+    index = read_index(output)
+    assert sorted(index) == IDS
+    assert read_record(output, IDS[-1], index)["Product"]["Name"] == f"Product {IDS[-1]}"
+    with gzip.open(output, "rt") as f:
+        assert [json.loads(line)["id"] for line in f] == IDS
+
+
+def test_migrate_requeues_records_missing_from_the_new_output(woolies, tmp_path):
+    stub, url = woolies()
+    checkpoint = str(tmp_path / "scrape_jobs.sqlite")
+    fetcher_args = {"base_url": url, "rate": 0, "backoff": 0}
+    job = ScrapeJob("bakery", str(tmp_path / "old.jsonl.gz"), checkpoint)
+    asyncio.run(job.run(IDS[:4], **fetcher_args))
+    job.close()
+
+    # The job moves to a new file: nothing is in it, so the done IDs are fetched again
+    output = str(tmp_path / "Woolies bakery.jsonl.gz")
+    job = ScrapeJob("bakery", output, checkpoint)
+    assert sorted(job.todo()) == IDS[:4]
+    asyncio.run(job.run(IDS[:4], **fetcher_args))
+    job.close()
+    assert sorted(read_index(output)) == IDS[:4]
+
+
+def test_scrape_jobs_and_delta_refresh_read_the_same_listing(tmp_path, monkeypatch):
+    listings = {
+        "Woolies pantry.csv": "1,Flour,$2.00\n2,Sugar,$3.00\n",
+        "Woolies 46 Pantry pantry.csv": "2,Sugar,$3.00\n3,Rice,$4.00\n",
+        "Woolies fruit-veg.csv": "4,Apple,$1.00\n",
+        "Woolies pantry.csv.bak": "5,Salt,$1.00\n",
+    }
+    for file_name, content in listings.items():
+        (tmp_path / file_name).write_text(content)
+    monkeypatch.setattr(product_fetcher, "ID_DIR", str(tmp_path))
+    monkeypatch.setitem(delta_scrape.LISTING_DIRS, "woolies", (str(tmp_path), "Woolies"))
+    assert [os.path.basename(path) for path in listing_files("pantry", str(tmp_path))] == ["Woolies 46 Pantry pantry.csv", "Woolies pantry.csv"]
+    assert category_ids("pantry") == ["2", "3", "1"]
+    assert delta_scrape.read_listing("woolies", "pantry")["Stockcode"].tolist() == category_ids("pantry")
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from name_index import NameIndex
+from product_finder import top_k
+
+NAMES = pd.Series([
+    "Obento Soba Noodles 200g",
+    "Hakubaku Noodles Soba",
+    "Soba-Noodles Organic",
+    "Udon noodles",
+    "White Wings Plain All-Purpose Flour",
+    "Plain all purpose flour",
+    "Self-Raising Flour 1kg",
+    "Flour, self raising",
+    None,
+    np.nan,
+    "Salt & Pepper Grinder",
+    "Peanut Butter 5 Pack",
+    "Butter Chicken Sauce",
+    "SOBA",
+    "Sobanoodles",
+])
+
+
+# What the index replaces: every keyword as a whole word, case insensitive
+def regex_rows(names: pd.Series, keywords: list) -> np.ndarray:
+    mask = np.ones(len(names), dtype=bool)
+    for keyword in keywords:
+        mask &= names.str.contains(fr"\b{keyword}\b", case=False, na=False).to_numpy()
+    return np.flatnonzero(mask)
+
+
+@pytest.mark.parametrize("keywords", [
+    ["soba"],
+    ["soba", "noodles"],
+    ["Noodles", "Soba"],
+    ["noodle"],
+    ["flour"],
+    ["all-purpose", "flour"],
+    ["self-raising"],
+    ["plain", "all-purpose"],
+    ["5"],
+    ["butter"],
+    ["peanut", "butter"],
+    ["salt", "&", "pepper"],
+    # No token at all: only the regex decides
+    ["&"],
+    ["missing"],
+    [],
+])
+def test_lookup_matches_the_regex(keywords):
+    index = NameIndex(NAMES)
+    assert index.lookup(keywords).tolist() == regex_rows(NAMES, keywords).tolist()
+
+
+# What top_k replaces: a stable sort (NaN last) and the first k
+def sorted_head(values: np.ndarray, k) -> list:
+    order = pd.Series(values).sort_values(kind="stable").index.tolist()
+    return order if k is None else order[:k]
+
+
+@pytest.mark.parametrize("values", [
+    [3.0, 1.0, 2.0, 5.0, 4.0],
+    [2.0, 1.0, 2.0, 1.0, 2.0, 1.0],
+    [np.nan, 1.0, np.nan, 0.5, 2.0],
+    [np.nan, np.nan, 3.0],
+    [np.nan, np.nan],
+    [1.0],
+    [],
+])
+@pytest.mark.parametrize("k", [None, 0, 1, 2, 3, 5, 10])
+def test_top_k_matches_a_stable_sort(values, k):
+    values = np.array(values, dtype=float)
+    assert top_k(values, k).tolist() == sorted_head(values, k)
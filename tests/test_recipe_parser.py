@@ -0,0 +1,40 @@
+import pytest
+
+from recipe_parser import PARSER_MIN_CONFIDENCE, parse_line, parse_recipe
+
+
+@pytest.mark.parametrize("line, names", [
+    ("2 cups plain/all-purpose flour", ["plain flour"]),
+    ("3 garlic cloves, finely chopped", ["garlic cloves"]),
+    ("1 x 400g tin diced tomatoes", ["tomatoes"]),
+    ("Salt and pepper to taste", ["salt", "pepper"]),
+    # The first alternative is the one to buy
+    ("4 cups chicken stock or water", ["chicken stock"]),
+    ("1 cup milk or cream", ["milk"]),
+    ("1 Cup Milk Or Cream", ["milk"]),
+])
+def test_parse_line(line, names):
+    assert parse_line(line) == (names, 1.0)
+
+
+# "and" after a quantity can be one product or two: ChatGPT decides
+@pytest.mark.parametrize("line", ["1 tsp salt and pepper", "2 cups fruit and nut mix"])
+def test_measured_and_is_unsure(line):
+    assert parse_line(line)[1] < PARSER_MIN_CONFIDENCE
+
+
+def test_parse_recipe():
+    recipe = """
+    Ingredients:
+    4 cups chicken stock or water
+    1 cup milk or cream
+    2 carrots, diced
+    Method:
+    Bring the stock to the boil
+    """
+    assert parse_recipe(recipe) == (["chicken stock", "milk", "carrots"], 1.0)
+    # The lines after the method are not ingredients
+    assert parse_recipe(recipe + "1 tsp salt and pepper")[1] == 1.0
+    assert parse_recipe("1 tsp salt and pepper\n2 carrots")[1] < PARSER_MIN_CONFIDENCE
+    # One line is a dish name more often than an ingredient list
+    assert parse_recipe("Chicken soup")[1] < PARSER_MIN_CONFIDENCE
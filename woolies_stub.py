@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import pandas as pd
+from aiohttp import web
+
+from product_fetcher import ID_DIR, RECORDED_DIR
+
+# Local stand-in for the Woolies product detail API, to try the fetcher without hitting the website:
+#   python woolies_stub.py --delay 0.1 --rate-limit 20 --error-rate 0.05
+#   WOOLIES_BASE_URL=http://127.0.0.1:8002 python scrape_jobs.py bakery
+# Serves the responses recorded with python scrape_jobs.py bakery --record, and with --ids the products
+# of the ID scraper outputs that weren't recorded (built from their listing)
+# GET /stats -> requests received, most requests in flight at once, requests answered with 429
+
+
+# A detail response built from a row of an ID scraper output (ID, Name, Price, Cup Price, Link)
+def listing_detail(row: pd.Series) -> dict:
+    price = pd.to_numeric(str(row["Price"]).lstrip("$"), errors="coerce")
+    return {
+        "Product": {
+            "Stockcode": int(row["ID"]),
+            "Name": row["Name"],
+            "DisplayName": row["Name"],
+            "Price": None if pd.isna(price) else float(price),
+            "CupString": row["Cup Price"],
+            "HasCupPrice": isinstance(row["Cup Price"], str),
+            "SapCategories": None,
+        },
+        "PrimaryCategory": None,
+        "AdditionalAttributes": {"ingredients": None},
+    }
+
+
+class WooliesStub:
+    def __init__(self, recorded_dir: str, ids_dir: str = None, delay: float = 0.1, jitter: float = 0.05,
+                 error_rate: float = 0.0, rate_limit: float = 0.0):
+        self.recorded_dir = recorded_dir
+        self.delay = delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.listings = {}
+        if ids_dir:
+            for file_name in sorted(os.listdir(ids_dir)):
+                if file_name.endswith(".csv"):
+                    df = pd.read_csv(os.path.join(ids_dir, file_name), header=None, dtype=str,
+                                     names=["ID", "Name", "Price", "Cup Price", "Link"])
+                    for _, row in df.dropna(subset=["ID"]).iterrows():
+                        self.listings.setdefault(row["ID"], row)
+        # Start times of the requests of the last second, for the rate limit
+        self.recent = []
+        self.in_flight = 0
+        self.stats = {"requests": 0, "max_in_flight": 0, "throttled": 0, "errors": 0, "not_found": 0}
+
+    def recorded(self, stockcode: str):
+        path = os.path.join(self.recorded_dir, f"{stockcode}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read()
+        if stockcode in self.listings:
+            return json.dumps(listing_detail(self.listings[stockcode]))
+        return None
+
+    async def home(self, request: web.Request) -> web.Response:
+        response = web.Response(text="<html><body>Woolies stub</body></html>", content_type="text/html")
+        response.set_cookie("bm_sz", "stub")
+        return response
+
+    async def product_detail(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        now = time.monotonic()
+        self.recent = [start for start in self.recent if now - start < 1]
+        if self.rate_limit and len(self.recent) >= self.rate_limit:
+            self.stats["throttled"] += 1
+            return web.json_response({"error": "Too many requests"}, status=429, headers={"Retry-After": "1"})
+        self.recent.append(now)
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            await asyncio.sleep(self.delay + random.uniform(0, self.jitter))
+        finally:
+            self.in_flight -= 1
+        if random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": "Stub server error"}, status=503)
+        body = self.recorded(request.match_info["stockcode"])
+        if body is None:
+            self.stats["not_found"] += 1
+            return web.json_response({"error": "Not found"}, status=404)
+        return web.Response(text=body, content_type="application/json")
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", self.home)
+        app.router.add_get("/apis/ui/product/detail/{stockcode}", self.product_detail)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Woolies product detail stub server")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--recorded", default=RECORDED_DIR, help="folder of the recorded responses ({stockcode}.json)")
+    parser.add_argument("--ids", nargs="?", const=ID_DIR, help=f"also serve the products of the ID CSVs (default: {ID_DIR})")
+    parser.add_argument("--delay", type=float, default=0.1, help="seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.05, help="random extra seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering 429 (0: no limit)")
+    args = parser.parse_args()
+    stub = WooliesStub(args.recorded, args.ids, args.delay, args.jitter, args.error_rate, args.rate_limit)
+    web.run_app(stub.app(), host="127.0.0.1", port=args.port)